@@ -0,0 +1,138 @@
+"""
+Peak memory and latency of loading a large image for display: full decode and scale against decode-time scaling.
+
+Every path runs in a fresh process so its peak RSS is measured on its own. Peak RSS needs the resource module,
+so this benchmark runs on Linux and macOS.
+
+    python -m benchmarks.bench_decode --megapixels 45 --repeat 5
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QRect  # noqa: E402
+from PyQt5.QtGui import QColor, QImage, QPainter  # noqa: E402
+
+from models.image_loader import load_scaled_image  # noqa: E402
+
+DISPLAY_SIZE = (800, 600)
+PATHS = ("full_decode", "decode_scaled")
+
+
+def create_image(path, megapixels):
+    """
+    Writes a 4:3 JPEG with some structure of about the given number of megapixels.
+    :param path: Destination path
+    :param megapixels: Size of the image
+    :return: None
+    """
+    width = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = width * 3 // 4
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QColor(40, 90, 40))
+    painter = QPainter(image)
+    for i in range(200):
+        painter.fillRect(QRect(i * 7919 % width, i * 104729 % height, width // 20, height // 20),
+                         QColor(i * 37 % 255, i * 91 % 255, i * 53 % 255))
+    painter.end()
+    image.save(path, "JPG", 90)
+
+
+def load_full_decode(path, size):
+    """
+    The previous loading path: decode at full resolution, then scale.
+    :param path: Path to the image
+    :param size: Target (width, height) tuple
+    :return: Scaled QImage
+    """
+    return QImage(path).scaled(size[0], size[1])
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident set size of this process. On Linux the high water mark of the address space is read,
+    as ru_maxrss can carry over the peak of the parent process.
+    :return: Megabytes
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(path, mode, repeat):
+    """
+    Loads the image repeatedly with one path, in this process.
+    :param path: Path to the image
+    :param mode: One of PATHS
+    :param repeat: Number of loads
+    :return: Dictionary with the latencies and the peak RSS
+    """
+    load = load_full_decode if mode == "full_decode" else load_scaled_image
+    baseline_rss = get_peak_rss_mb()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = load(path, DISPLAY_SIZE)
+        latencies.append(time.perf_counter() - start)
+        assert not image.isNull()
+    return {"path": mode, "best_ms": min(latencies) * 1000, "mean_ms": sum(latencies) / repeat * 1000,
+            "peak_rss_mb": get_peak_rss_mb(), "rss_increase_mb": get_peak_rss_mb() - baseline_rss}
+
+
+def main(argv=None):
+    """
+    Runs every decode path in a fresh process, so their memory use is measured apart, and prints the results.
+    With --measure, measures a single path in this process instead and prints its result as JSON.
+    :param argv: Arguments, defaults to sys.argv
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=45)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--image", help="Use this image instead of a generated one.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    parser.add_argument("--measure", choices=PATHS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure(args.image, args.measure, args.repeat)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as folder:
+        image = args.image
+        if not image:
+            image = os.path.join(folder, "large.jpg")
+            create_image(image, args.megapixels)
+        results = []
+        for mode in PATHS:
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_decode", "--measure", mode,
+                                     "--image", image, "--repeat", str(args.repeat)],
+                                    check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'path':<15} {'best ms':>10} {'mean ms':>10} {'peak RSS MB':>12} {'RSS increase MB':>16}")
+    for result in results:
+        print(f"{result['path']:<15} {result['best_ms']:>10.1f} {result['mean_ms']:>10.1f} "
+              f"{result['peak_rss_mb']:>12.1f} {result['rss_increase_mb']:>16.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
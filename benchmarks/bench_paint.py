@@ -0,0 +1,97 @@
+"""
+Frame time of ImageWindowView while dragging a new rectangle, for a growing number of committed boxes.
+
+    python -m benchmarks.bench_paint --boxes 10 100 300 1000 3000 --frames 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QEvent, QPoint, Qt  # noqa: E402
+from PyQt5.QtGui import QMouseEvent  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from models.box_store import BoxStore  # noqa: E402
+from views.image_window_view import ImageWindowView  # noqa: E402
+
+
+def mouse_event(event_type, point):
+    """
+    Creates a left button mouse event at the point. Shift is held so a new rectangle is drawn even over boxes.
+    :param event_type: QEvent type
+    :param point: QPoint
+    :return: QMouseEvent
+    """
+    return QMouseEvent(event_type, point, Qt.LeftButton, Qt.LeftButton, Qt.ShiftModifier)
+
+
+def measure(app, view, count, frames, seed=42):
+    """
+    Measures the mean drag frame time and full repaint time with the given number of committed boxes.
+    :param app: QApplication
+    :param view: ImageWindowView
+    :param count: Number of committed boxes
+    :param frames: Number of mouse moves to time
+    :param seed: Seed of the random boxes
+    :return: Dictionary with the timings in milliseconds
+    """
+    rng = random.Random(seed)
+    width, height = view.display_size
+    boxes = BoxStore()
+    for _ in range(count):
+        x, y = rng.randrange(width - 40), rng.randrange(height - 40)
+        boxes.append(x, y, x + rng.randrange(5, 40), y + rng.randrange(5, 40), 0)
+    view.boxes = boxes
+    view.repaint()
+
+    view.mousePressEvent(mouse_event(QEvent.MouseButtonPress, QPoint(50, 50)))
+    app.processEvents()
+    start = time.perf_counter()
+    for frame in range(frames):
+        view.mouseMoveEvent(mouse_event(QEvent.MouseMove, QPoint(60 + frame % 300, 60 + frame % 200)))
+        app.processEvents()
+    drag = (time.perf_counter() - start) / frames
+    view.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, QPoint(50, 50)))
+    app.processEvents()
+
+    start = time.perf_counter()
+    for frame in range(frames // 10 or 1):
+        boxes.version += 1  # Forces the committed box layer to be redrawn
+        view.repaint()
+    full = (time.perf_counter() - start) / (frames // 10 or 1)
+    return {"boxes": count, "drag_frame_ms": drag * 1000, "full_redraw_ms": full * 1000}
+
+
+def main(argv=None):
+    """
+    Runs the paint benchmark for every box count and prints the frame times.
+    :param argv: Arguments, defaults to sys.argv
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boxes", type=int, nargs="+", default=[10, 100, 300, 1000, 3000])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    app = QApplication(sys.argv[:1])
+    view = ImageWindowView((800, 600), {"0": "object"})
+    view.show()
+
+    results = [measure(app, view, count, args.frames) for count in args.boxes]
+    print(f"{'boxes':>8} {'drag frame ms':>15} {'full redraw ms':>15}")
+    for result in results:
+        print(f"{result['boxes']:>8} {result['drag_frame_ms']:>15.3f} {result['full_redraw_ms']:>15.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
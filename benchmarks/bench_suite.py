@@ -0,0 +1,348 @@
+"""
+Benchmarks the labelling and dataset-building hot paths on synthetic datasets and compares them to a baseline.
+
+Every dataset has the given number of images with 1-8 boxes each, classes drawn from a Zipf distribution.
+
+    python -m benchmarks.bench_suite --sizes 1000 10000 100000
+    python -m benchmarks.bench_suite --sizes 1000 --save-baseline
+    python -m benchmarks.bench_suite --json results.json --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np  # noqa: E402
+from PyQt5.QtCore import QBuffer, QIODevice, QRect  # noqa: E402
+from PyQt5.QtGui import QColor, QImage, QPainter  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from models.image_window_model import ImageWindowModel  # noqa: E402
+from models.setup_model import SetupModel  # noqa: E402
+from models.yolo_labels import write_labels  # noqa: E402
+from views.image_window_view import ImageWindowView  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DISPLAY_SIZE = (800, 600)
+
+
+def encode_sample_image(width, height):
+    """
+    Encodes a JPEG with a gradient and some shapes, so decoding it is not trivially cheap.
+    :param width: Width of the image
+    :param height: Height of the image
+    :return: JPEG bytes
+    """
+    image = QImage(width, height, QImage.Format_RGB32)
+    painter = QPainter(image)
+    for x in range(0, width, 8):
+        painter.fillRect(x, 0, 8, height, QColor(x * 255 // width, 128, 255 - x * 255 // width))
+    for i in range(20):
+        painter.fillRect(QRect(i * 29 % width, i * 17 % height, 40, 30), QColor(i * 12, 255 - i * 12, i * 5))
+    painter.end()
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "JPG")
+    return bytes(buffer.data())
+
+
+def make_dataset(folder, count, classes, image_size, zipf=1.1, seed=42):
+    """
+    Writes a synthetic dataset of images and YOLO labels.
+    :param folder: Folder to create the images and labels folders in
+    :param count: Number of images
+    :param classes: Number of classes
+    :param image_size: (width, height) of the images
+    :param zipf: Exponent of the Zipf class distribution
+    :param seed: Seed of the random boxes
+    :return: The image files, label files and the boxes of every image as (n, 5) arrays of class, x1, y1, x2, y2
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, classes + 1) ** zipf
+    images_folder = os.path.join(folder, "images")
+    labels_folder = os.path.join(folder, "labels")
+    os.makedirs(images_folder, exist_ok=True)
+    os.makedirs(labels_folder, exist_ok=True)
+    data = encode_sample_image(*image_size)
+    width, height = image_size
+
+    image_files, label_files, boxes = [], [], []
+    for i in range(count):
+        image_file = os.path.join(images_folder, f"img_{i}.jpg")
+        label_file = os.path.join(labels_folder, f"img_{i}.txt")
+        with open(image_file, "wb") as f:
+            f.write(data)
+
+        n = int(rng.integers(1, 9))
+        labels = rng.choice(classes, size=n, p=weights / weights.sum())
+        x1 = rng.uniform(0, width * 0.8, n)
+        y1 = rng.uniform(0, height * 0.8, n)
+        x2 = x1 + rng.uniform(4, width * 0.2, n)
+        y2 = y1 + rng.uniform(4, height * 0.2, n)
+        write_labels(label_file, np.column_stack([labels, (x1 + x2) / 2 / width, (y1 + y2) / 2 / height,
+                                                  (x2 - x1) / width, (y2 - y1) / height]))
+
+        image_files.append(image_file)
+        label_files.append(label_file)
+        boxes.append(np.column_stack([labels, x1, y1, x2, y2]))
+    return image_files, label_files, boxes
+
+
+def best_of(repeat, run, setup=None):
+    """
+    Times the function and returns the fastest of the runs.
+    :param repeat: Number of runs
+    :param run: Function to time, called with the result of setup
+    :param setup: Optional untimed function called before every run
+    :return: Seconds of the fastest run
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(seconds, items):
+    """
+    Creates a benchmark result.
+    :param seconds: Seconds of the fastest run
+    :param items: Number of items processed per run
+    :return: Dictionary with the total and per item time
+    """
+    return {"seconds": seconds, "items": items, "per_item_us": seconds / items * 1e6 if items else 0.0}
+
+
+def bench_get_image_paths(folder, repeat):
+    """
+    Times streaming discovery of the image paths until the folder is fully scanned.
+    :param folder: Folder of the synthetic dataset
+    :param repeat: Number of runs
+    :return: Benchmark result
+    """
+    setup_model = SetupModel()
+    setup_model.set_images_folder(os.path.join(folder, "images"))
+    seconds = best_of(repeat, lambda _: len(setup_model.get_image_paths()))
+    return result(seconds, len(setup_model.get_image_paths()))
+
+
+def bench_load_and_scale_image(image_files, samples, repeat):
+    """
+    Times decoding and scaling images to the display size without the scaled image cache.
+    :param image_files: The image files
+    :param samples: Number of images to decode
+    :param repeat: Number of runs
+    :return: Benchmark result
+    """
+    view = ImageWindowView(DISPLAY_SIZE, {})
+    view.image_cache = None
+    paths = image_files[:samples]
+    seconds = best_of(repeat, lambda _: [view.load_and_scale_image(path) for path in paths])
+    return result(seconds, len(paths))
+
+
+def fill_boxes(model, boxes):
+    """
+    Replaces the boxes of the model with the boxes of one image.
+    :param model: ImageWindowModel
+    :param boxes: Boxes of the image as an (n, 5) array
+    :return: None
+    """
+    model.boxes.clear()
+    model.boxes.extend(boxes[:, 1:], boxes[:, 0].astype(np.int32))
+
+
+def bench_get_calculations(image_files, boxes, repeat):
+    """
+    Times converting the boxes of every image to YOLO label lines.
+    :param image_files: The image files
+    :param boxes: Boxes of every image as (n, 5) arrays
+    :param repeat: Number of runs
+    :return: Benchmark result
+    """
+    model = ImageWindowModel(image_files)
+    image = QImage(*DISPLAY_SIZE, QImage.Format_RGB32)
+
+    def run(_):
+        for image_boxes in boxes:
+            fill_boxes(model, image_boxes)
+            model.get_calculations(image)
+
+    seconds = best_of(repeat, run)
+    return result(seconds, len(boxes))
+
+
+def bench_save_calculations(image_files, boxes, folder, repeat):
+    """
+    Times writing the label file of every image directly to disk.
+    :param image_files: The image files
+    :param boxes: Boxes of every image as (n, 5) arrays
+    :param folder: Scratch folder to write to
+    :param repeat: Number of runs
+    :return: Benchmark result
+    """
+    model = ImageWindowModel(image_files)
+    image = QImage(*DISPLAY_SIZE, QImage.Format_RGB32)
+    output = os.path.join(folder, "saved_labels")
+    calculations = []
+    for image_boxes in boxes:
+        fill_boxes(model, image_boxes)
+        calculations.append(model.get_calculations(image))
+
+    def setup():
+        shutil.rmtree(output, ignore_errors=True)
+        model.current_image_index = 0
+
+    def run(_):
+        for index, image_calculations in enumerate(calculations):
+            model.current_image_index = index
+            fill_boxes(model, boxes[index])
+            model.save_calculations(image_calculations, output)
+
+    seconds = best_of(repeat, run, setup)
+    shutil.rmtree(output, ignore_errors=True)
+    return result(seconds, len(boxes))
+
+
+def bench_split_train_val_test(image_files, label_files, repeat):
+    """
+    Times the stratified train, validation and test split of the split and prepare commands, including parsing
+    every label file.
+    :param image_files: The image files
+    :param label_files: The label files
+    :param repeat: Number of runs
+    :return: Benchmark result
+    """
+    model = ImageWindowModel(image_files, percentages=(70, 20, 10))
+    seconds = best_of(repeat, lambda _: model.split_train_val_test(image_files, label_files))
+    return result(seconds, len(image_files))
+
+
+def bench_move_to_dataset_folder(image_files, label_files, folder, repeat):
+    """
+    Times moving a fresh copy of the dataset into the train, validation and test folders.
+    :param image_files: The image files
+    :param label_files: The label files
+    :param folder: Scratch folder to write to
+    :param repeat: Number of runs
+    :return: Benchmark result
+    """
+    source = os.path.dirname(os.path.dirname(image_files[0]))
+    work = os.path.join(folder, "move_source")
+    dataset = os.path.join(folder, "move_dataset")
+    names = [os.path.basename(file) for file in image_files]
+    label_names = [os.path.basename(file) for file in label_files]
+
+    def setup():
+        shutil.rmtree(work, ignore_errors=True)
+        shutil.rmtree(dataset, ignore_errors=True)
+        shutil.copytree(source, work)
+        model = ImageWindowModel([os.path.join(work, "images", name) for name in names],
+                                 percentages=(70, 20, 10), dataset_folder=dataset)
+        images = [os.path.join(work, "images", name) for name in names]
+        labels = [os.path.join(work, "labels", name) for name in label_names]
+        return model, model.split_train_val_test(images, labels)
+
+    seconds = best_of(repeat, lambda state: state[0].move_to_dataset_folder(*state[1]), setup)
+    shutil.rmtree(work, ignore_errors=True)
+    shutil.rmtree(dataset, ignore_errors=True)
+    return result(seconds, len(image_files) + len(label_files))
+
+
+def run_suite(count, args):
+    """
+    Runs every benchmark on a synthetic dataset of the given size.
+    :param count: Number of images
+    :param args: Parsed command line arguments
+    :return: Dictionary of benchmark name to result
+    """
+    with tempfile.TemporaryDirectory(dir=args.workdir) as folder:
+        image_files, label_files, boxes = make_dataset(os.path.join(folder, "raw"), count, args.classes,
+                                                       tuple(args.image_size), args.zipf)
+        return {
+            "get_image_paths": bench_get_image_paths(os.path.join(folder, "raw"), args.repeat),
+            "load_and_scale_image": bench_load_and_scale_image(image_files, args.decode_samples, args.repeat),
+            "get_calculations": bench_get_calculations(image_files, boxes, args.repeat),
+            "save_calculations": bench_save_calculations(image_files, boxes, folder, args.repeat),
+            "split_train_val_test": bench_split_train_val_test(image_files, label_files, args.repeat),
+            "move_to_dataset_folder": bench_move_to_dataset_folder(image_files, label_files, folder, args.repeat),
+        }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the results to the baseline and prints the ratio of every benchmark.
+    :param results: Dictionary of dataset size to benchmark results
+    :param baseline: Dictionary of dataset size to benchmark results of the baseline
+    :param threshold: Ratio above which a benchmark counts as a regression
+    :return: List of (size, name, ratio) of the regressions
+    """
+    regressions = []
+    print(f"{'size':>8} {'benchmark':<24} {'seconds':>10} {'baseline':>10} {'ratio':>7}")
+    for size, benchmarks in results.items():
+        for name, current in benchmarks.items():
+            reference = baseline.get(size, {}).get(name)
+            if not reference:
+                print(f"{size:>8} {name:<24} {current['seconds']:>10.4f} {'-':>10} {'-':>7}")
+                continue
+            ratio = current["per_item_us"] / reference["per_item_us"] if reference["per_item_us"] else 1.0
+            flag = "  REGRESSION" if ratio > threshold else ""
+            print(f"{size:>8} {name:<24} {current['seconds']:>10.4f} {reference['seconds']:>10.4f} "
+                  f"{ratio:>7.2f}{flag}")
+            if ratio > threshold:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Runs the suite for every dataset size, compares the results to the baseline and optionally stores them as the
+    new baseline.
+    :param argv: Arguments, defaults to sys.argv
+    :return: Exit code, 1 if a benchmark regressed and --fail-on-regression is set
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="Numbers of images to benchmark.")
+    parser.add_argument("--classes", type=int, default=20)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Exponent of the class distribution.")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 480], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--decode-samples", type=int, default=200, help="Images decoded by load_and_scale_image.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", help="Folder the synthetic datasets are created in.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Per item slowdown counted as a regression.")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])  # noqa: F841, needed by the view
+    results = {str(size): run_suite(size, args) for size in args.sizes}
+    report = {"python": platform.python_version(), "platform": platform.platform(), "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(dict(report, results=baseline), f, indent=2)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
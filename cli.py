@@ -0,0 +1,335 @@
+"""
+Headless dataset preparation for already labelled YOLO folders.
+
+    python -m cli resize <images folder> <output folder> --width 800 --height 600
+    python -m cli split <labelled folder> <dataset folder> --percentages 70 15 15
+    python -m cli yaml <dataset folder> --labels labels.json
+    python -m cli prepare <labelled folder> <dataset folder> --width 800 --height 600 --labels labels.json
+    python -m cli report <dataset folder> --labels labels.json --output report.json
+    python -m cli shards <dataset folder> --labels labels.json --max-shard-mb 1024
+"""
+import argparse
+import os
+import sys
+
+from models import file_ops
+from models.batch_resize import resize_images
+from models.dataset_report import (REPORT_FILENAME, build_report, count_issues, find_splits, list_stems,
+                                   summarize_report, write_report)
+from models.image_discovery import DEFAULT_EXTENSIONS
+from models.image_window_model import SHARDS_FOLDER, ImageWindowModel
+from models.label_index import LabelIndex
+from models.metrics import metrics
+from models.setup_model import SetupModel
+from models.shards import export_shards
+
+
+def print_progress(stage):
+    """
+    Returns a progress callback that prints the progress of a stage on one line.
+    :param stage: Name of the stage
+    :return: Callback taking (done, total)
+    """
+    def progress(done, total):
+        print(f"\r{stage}: {done}/{total}", end="\n" if done == total else "", flush=True)
+    return progress
+
+
+def print_failures(failed):
+    """
+    Prints the images that could not be resized.
+    :param failed: Dictionary of image path to error message
+    :return: None
+    """
+    if failed:
+        print(f"Could not resize {len(failed)} image(s), they are skipped:", file=sys.stderr)
+        for path, error in failed.items():
+            print(f"  {path}: {error}", file=sys.stderr)
+
+
+def find_labelled_pairs(folder):
+    """
+    Finds the images of a labelled folder that have a label file with the same name.
+    Images are looked up in images/, scaled_images/ or the folder itself, labels in labels/.
+    Images sharing a name with another extension would share a label file, they are skipped and reported.
+    :param folder: The labelled folder
+    :return: The image files and label files, paired by position
+    """
+    labels_folder = os.path.join(folder, "labels")
+    images_folder = folder
+    for name in ("images", "scaled_images"):
+        if os.path.isdir(os.path.join(folder, name)):
+            images_folder = os.path.join(folder, name)
+            break
+
+    labels = {os.path.splitext(f)[0]: os.path.join(labels_folder, f)
+              for f in os.listdir(labels_folder) if f.endswith('.txt')}
+    images = {}
+    for f in sorted(os.listdir(images_folder)):
+        stem, extension = os.path.splitext(f)
+        if extension.lower() in DEFAULT_EXTENSIONS and stem in labels:
+            images.setdefault(stem, []).append(os.path.join(images_folder, f))
+    image_files, label_files = [], []
+    for stem, paths in images.items():
+        if len(paths) > 1:
+            print(f"Skipping {', '.join(paths)}: they share the label file {labels[stem]}", file=sys.stderr)
+            continue
+        image_files.append(paths[0])
+        label_files.append(labels[stem])
+    return image_files, label_files
+
+
+def find_label_files(dataset_folder):
+    """
+    Finds the label files in the labels folder of every split of a dataset folder.
+    :param dataset_folder: The dataset folder
+    :return: The label files
+    """
+    return [label_file for _, labels_folder in find_splits(dataset_folder).values()
+            for label_file in list_stems(labels_folder, (".txt",)).values()]
+
+
+def load_label_map(labels_json, label_files):
+    """
+    Returns the label map from a JSON file, or numbered names for the classes found in the label files.
+    :param labels_json: Path of the labels JSON file, may be None
+    :param label_files: The label files
+    :return: The label map
+    """
+    setup_model = SetupModel()
+    if labels_json:
+        try:
+            setup_model.import_json_labels(labels_json)
+        except ValueError as e:
+            raise ValueError(f"{labels_json}: {e}") from None
+        return setup_model.label_map
+    classes = LabelIndex.build(label_files).classes.tolist()
+    return {label: str(label) for label in range(max(classes) + 1)} if classes else {}
+
+
+def split_into_dataset(image_files, label_files, dataset_folder, percentages, move):
+    """
+    Splits the labelled files and materialises the dataset folder. Unless moving, the files
+    are copied into a staging folder inside the dataset folder and renamed into their splits.
+    :param image_files: The image files
+    :param label_files: The label files, paired with the image files
+    :param dataset_folder: The dataset folder
+    :param percentages: The train, validation and test percentages
+    :param move: True to move the source files instead of copying them
+    :return: The achieved per-class distribution
+    """
+    model = ImageWindowModel(image_files, percentages=percentages, dataset_folder=dataset_folder)
+    if not move:
+        staging_path = model.create_staging_path()
+        image_files = file_ops.copy_files(image_files, os.path.join(staging_path, "images"),
+                                          progress=print_progress("Staging images"))
+        label_files = file_ops.copy_files(label_files, os.path.join(staging_path, "labels"),
+                                          progress=print_progress("Staging labels"))
+
+    try:
+        splits = model.split_train_val_test(image_files, label_files)
+        model.move_to_dataset_folder(*splits, progress=print_progress("Moving"))
+    finally:
+        # The staged files are copies, a failed move must not leave them behind
+        model.clear_staging()
+    return model.split_distribution
+
+
+def create_yaml(dataset_folder, label_map, shards_folder=None):
+    """
+    Writes dataset.yaml, or dataset_shards.yaml for packed shards, into the dataset folder.
+    :param dataset_folder: The dataset folder
+    :param label_map: The label map
+    :param shards_folder: Folder of the shards relative to the dataset folder, None for the image folders
+    :return: None
+    """
+    setup_model = SetupModel()
+    setup_model.label_map = label_map
+    setup_model.set_dataset_folder(dataset_folder)
+    setup_model.create_yaml_file(shards_folder)
+
+
+def print_distribution(distribution):
+    """
+    Prints the achieved share of every class in each split.
+    :param distribution: Dictionary of class to {split name: fraction}
+    :return: None
+    """
+    for label, shares in sorted(distribution.items()):
+        print(f"  {label}: " + ", ".join(f"{name} {share:.1%}" for name, share in shares.items()))
+
+
+def run_resize(args):
+    """
+    Runs the resize command.
+    :param args: Parsed arguments
+    :return: None
+    """
+    image_files = [os.path.join(args.images, f) for f in sorted(os.listdir(args.images))
+                   if f.lower().endswith(DEFAULT_EXTENSIONS)]
+    _, failed = resize_images(image_files, args.output, (args.width, args.height), args.workers,
+                              print_progress("Resizing"))
+    print_failures(failed)
+
+
+def run_split(args):
+    """
+    Runs the split command.
+    :param args: Parsed arguments
+    :return: None
+    """
+    image_files, label_files = find_labelled_pairs(args.folder)
+    if not image_files:
+        print("No labelled images found in the selected folder", file=sys.stderr)
+        return
+    print_distribution(split_into_dataset(image_files, label_files, args.dataset, args.percentages, args.move))
+
+
+def run_yaml(args):
+    """
+    Runs the yaml command.
+    :param args: Parsed arguments
+    :return: None
+    """
+    label_files = find_label_files(args.dataset)
+    create_yaml(args.dataset, load_label_map(args.labels, label_files))
+
+
+def run_prepare(args):
+    """
+    Runs the prepare command: optional resize, split, dataset materialisation and YAML.
+    :param args: Parsed arguments
+    :return: None
+    """
+    image_files, label_files = find_labelled_pairs(args.folder)
+    if not image_files:
+        print("No labelled images found in the selected folder", file=sys.stderr)
+        return
+    label_map = load_label_map(args.labels, label_files)
+    move = False
+    if args.width and args.height:
+        staging_path = os.path.join(args.dataset, ".staging")
+        scaled, failed = resize_images(image_files, os.path.join(staging_path, "images"), (args.width, args.height),
+                                       args.workers, print_progress("Resizing"))
+        print_failures(failed)
+        label_files = [label for image, label in zip(image_files, label_files) if image in scaled]
+        image_files = [scaled[f] for f in image_files if f in scaled]
+        if not image_files:
+            return
+        # Stage every label under the name of its scaled image, which may be a numbered variant
+        names = [os.path.splitext(os.path.basename(f))[0] + ".txt" for f in image_files]
+        label_files = file_ops.copy_files(label_files, os.path.join(staging_path, "labels"),
+                                          progress=print_progress("Staging labels"), names=names)
+        move = True
+    print_distribution(split_into_dataset(image_files, label_files, args.dataset, args.percentages,
+                                          move or args.move))
+    create_yaml(args.dataset, label_map)
+
+
+def run_shards(args):
+    """
+    Runs the shards command.
+    :param args: Parsed arguments
+    :return: None
+    """
+    label_files = find_label_files(args.dataset)
+    label_map = load_label_map(args.labels, label_files)
+    manifest = export_shards(args.dataset, os.path.join(args.dataset, SHARDS_FOLDER), label_map,
+                             args.max_shard_mb * 1024 ** 2, progress=print_progress("Packing"))
+    create_yaml(args.dataset, label_map, SHARDS_FOLDER)
+    print(f"Shards written to {os.path.dirname(manifest)}")
+
+
+def run_report(args):
+    """
+    Runs the report command.
+    :param args: Parsed arguments
+    :return: Exit code
+    """
+    label_map = load_label_map(args.labels, []) if args.labels else None
+    report = build_report(args.dataset, label_map)
+    output = args.output or os.path.join(args.dataset, REPORT_FILENAME)
+    write_report(report, output)
+    print(summarize_report(report, label_map))
+    print(f"Report written to {output}")
+    return 1 if args.strict and count_issues(report) else 0
+
+
+def build_parser():
+    """
+    Builds the command line parser.
+    :return: ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Prepare YOLO datasets without the GUI.")
+    parser.add_argument("--metrics", help="Write stage latencies and counters to this file, .prom for Prometheus.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    resize = commands.add_parser("resize", help="Scale every image of a folder.")
+    resize.add_argument("images")
+    resize.add_argument("output")
+    resize.set_defaults(run=run_resize)
+
+    split = commands.add_parser("split", help="Split a labelled folder into train, val and test.")
+    split.add_argument("folder")
+    split.add_argument("dataset")
+    split.set_defaults(run=run_split)
+
+    yaml = commands.add_parser("yaml", help="Write dataset.yaml for a dataset folder.")
+    yaml.add_argument("dataset")
+    yaml.set_defaults(run=run_yaml)
+
+    prepare = commands.add_parser("prepare", help="Resize, split and write dataset.yaml in one go.")
+    prepare.add_argument("folder")
+    prepare.add_argument("dataset")
+    prepare.set_defaults(run=run_prepare)
+
+    report = commands.add_parser("report", help="Validate a dataset folder and report its statistics.")
+    report.add_argument("dataset")
+    report.add_argument("--output", help="Report JSON file, defaults to dataset_report.json in the dataset folder.")
+    report.add_argument("--strict", action="store_true", help="Exit with 1 if any problem is found.")
+    report.set_defaults(run=run_report)
+
+    shards = commands.add_parser("shards", help="Pack the splits of a dataset folder into large shard files.")
+    shards.add_argument("dataset")
+    shards.add_argument("--max-shard-mb", type=int, default=1024, help="Size at which a new shard is started.")
+    shards.set_defaults(run=run_shards)
+
+    for command in (resize, prepare):
+        command.add_argument("--width", type=int, default=800 if command is resize else None)
+        command.add_argument("--height", type=int, default=600 if command is resize else None)
+        command.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to all CPUs.")
+    for command in (split, prepare):
+        command.add_argument("--percentages", type=int, nargs=3, default=[70, 15, 15],
+                             metavar=("TRAIN", "VAL", "TEST"))
+        command.add_argument("--move", action="store_true", help="Move the source files instead of copying them.")
+    for command in (yaml, prepare, report, shards):
+        command.add_argument("--labels", help="Labels JSON file, as imported in the setup window.")
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs the command line entry point.
+    :param argv: Arguments, defaults to sys.argv
+    :return: Exit code
+    """
+    args = build_parser().parse_args(argv)
+    if args.command in ("split", "prepare") and sum(args.percentages) != 100:
+        print("Train, validation, and test percentages must add up to 100.", file=sys.stderr)
+        return 1
+    try:
+        code = args.run(args) or 0
+    except ValueError as e:
+        # Label, labels JSON and shard errors all name the file and the problem
+        print(e, file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"Could not access {e.filename or 'a file'}: {e.strerror or e}", file=sys.stderr)
+        return 1
+    if args.metrics:
+        metrics.dump(args.metrics)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 from PyQt5.QtWidgets import QApplication
 
@@ -10,6 +11,8 @@ import qtmodern.windows
 
 
 if __name__ == '__main__':
+    # The resize and pre-labeling pools spawn workers, a frozen build must not start the GUI in each of them
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     qtmodern.styles.dark(app)
 
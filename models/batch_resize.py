@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from models import file_ops
+from models.image_loader import load_scaled_image
+from models.metrics import metrics
+
+
+def resize_image(path, output_path, size):
+    """
+    Decodes, scales and saves one image as JPEG. Runs in a worker process.
+    :param path: Path to the source image
+    :param output_path: Path to save the scaled image to
+    :param size: Target (width, height) tuple
+    :return: Path of the scaled image
+    """
+    image = load_scaled_image(path, size)
+    if image.isNull():
+        raise OSError(f"Could not read image {path}")
+    partial_path = output_path + ".part"
+    if not image.save(partial_path, "JPG"):
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise OSError(f"Could not save image {output_path}")
+    os.replace(partial_path, output_path)
+    return output_path
+
+
+def resize_image_or_error(path, output_path, size):
+    """
+    Scales one image, returning the error instead of raising it so one bad file does not abort the batch.
+    Runs in a worker process.
+    :param path: Path to the source image
+    :param output_path: Path to save the scaled image to
+    :param size: Target (width, height) tuple
+    :return: Tuple of the path of the scaled image, None on error, and the error message or None
+    """
+    try:
+        return resize_image(path, output_path, size), None
+    except OSError as e:
+        return None, str(e)
+
+
+def resize_images(paths, output_folder, size, workers=None, progress=None):
+    """
+    Scales the images to the given size on a process pool. Images with the same stem, from subfolders or with
+    other extensions, are saved under numbered variants of it instead of overwriting each other. Images that
+    can't be read or saved are skipped and returned with their errors once the batch is done.
+    :param paths: Paths of the source images
+    :param output_folder: Folder to save the scaled images to
+    :param size: Target (width, height) tuple
+    :param workers: Number of worker processes, defaults to the number of CPUs
+    :param progress: Optional callback called with (done, total) after each image
+    :return: Dictionary of source path to scaled image path, and dictionary of failed source path to error
+    """
+    paths = list(paths)
+    os.makedirs(output_folder, exist_ok=True)
+    claimed = {}
+    output_paths = [os.path.join(output_folder, file_ops.claim_unique_stem(claimed, path) + ".jpg") for path in paths]
+    scaled = {}
+    failed = {}
+    # Spawn the workers, forking a process that runs a Qt application can deadlock
+    with metrics.timer("resize_batch"), \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = executor.map(resize_image_or_error, paths, output_paths, repeat(size), chunksize=16)
+        for done, (path, (output_path, error)) in enumerate(zip(paths, results), start=1):
+            if error:
+                failed[path] = error
+            else:
+                scaled[path] = output_path
+            if progress:
+                progress(done, len(paths))
+    metrics.increment("images_resized", len(scaled))
+    return scaled, failed
@@ -0,0 +1,218 @@
+import numpy as np
+
+from models.spatial_index import GridIndex
+
+
+class BoxStore:
+    """
+    This class is responsible for storing bounding boxes as contiguous NumPy arrays.
+    Corners are kept as (x1, y1, x2, y2) pixel coordinates next to the class and image id of each box.
+    With spatial_index set, a GridIndex is kept in sync for hit-testing.
+    """
+    def __init__(self, capacity=16, spatial_index=False):
+        self.coords = np.zeros((capacity, 4), dtype=np.float32)
+        self.classes = np.zeros(capacity, dtype=np.int32)
+        self.image_ids = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self.version = 0  # Increased on every change so readers can cache derived data
+        self.grid = GridIndex() if spatial_index else None
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity):
+        """
+        Grows the arrays so they can hold at least the given number of boxes.
+        :param capacity: The number of boxes to hold.
+        :return: None
+        """
+        if capacity <= len(self.classes):
+            return
+        capacity = max(capacity, 2 * len(self.classes))
+        coords = np.zeros((capacity, 4), dtype=self.coords.dtype)
+        classes = np.zeros(capacity, dtype=self.classes.dtype)
+        image_ids = np.zeros(capacity, dtype=self.image_ids.dtype)
+        coords[:self.size] = self.coords[:self.size]
+        classes[:self.size] = self.classes[:self.size]
+        image_ids[:self.size] = self.image_ids[:self.size]
+        self.coords, self.classes, self.image_ids = coords, classes, image_ids
+
+    def append(self, x1, y1, x2, y2, label, image_id=0):
+        """
+        Adds a box. The corners are normalised so that (x1, y1) is the top left corner.
+        :param x1: X coordinate of the first corner.
+        :param y1: Y coordinate of the first corner.
+        :param x2: X coordinate of the opposite corner.
+        :param y2: Y coordinate of the opposite corner.
+        :param label: The class of the box.
+        :param image_id: The image the box belongs to.
+        :return: None
+        """
+        self.reserve(self.size + 1)
+        self.coords[self.size] = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        self.classes[self.size] = label
+        self.image_ids[self.size] = image_id
+        if self.grid is not None:
+            self.grid.insert(self.size, self.coords[self.size].tolist())
+        self.size += 1
+        self.version += 1
+
+    def extend(self, coords, classes, image_ids=0):
+        """
+        Adds many boxes at once.
+        :param coords: Array of shape (n, 4) with the (x1, y1, x2, y2) corners.
+        :param classes: Array of n classes.
+        :param image_ids: Array of n image ids or a single image id for all boxes.
+        :return: None
+        """
+        coords = np.asarray(coords, dtype=self.coords.dtype).reshape(-1, 4)
+        count = len(coords)
+        self.reserve(self.size + count)
+        end = self.size + count
+        self.coords[self.size:end, :2] = np.minimum(coords[:, :2], coords[:, 2:])
+        self.coords[self.size:end, 2:] = np.maximum(coords[:, :2], coords[:, 2:])
+        self.classes[self.size:end] = classes
+        self.image_ids[self.size:end] = image_ids
+        if self.grid is not None:
+            for box_id, box in enumerate(self.coords[self.size:end].tolist(), start=self.size):
+                self.grid.insert(box_id, box)
+        self.size = end
+        self.version += 1
+
+    def extend_yolo(self, labels, width, height, image_id=0):
+        """
+        Adds boxes given as normalised YOLO rows, the inverse of to_yolo.
+        :param labels: Array of shape (n, 5) with (class, x_center, y_center, width, height) rows.
+        :param width: The width of the image the boxes are shown on.
+        :param height: The height of the image the boxes are shown on.
+        :param image_id: The image the boxes belong to.
+        :return: None
+        """
+        labels = np.asarray(labels, dtype=np.float64).reshape(-1, 5)
+        scale = np.array([width, height], dtype=np.float64)
+        centers = labels[:, 1:3] * scale
+        half_sizes = labels[:, 3:5] * scale / 2
+        self.extend(np.hstack([centers - half_sizes, centers + half_sizes]), labels[:, 0].astype(np.int32), image_id)
+
+    def pop(self):
+        """
+        Removes the last added box.
+        :return: None
+        """
+        if self.size:
+            self.size -= 1
+            self.version += 1
+            if self.grid is not None:
+                self.grid.remove(self.size, self.coords[self.size].tolist())
+
+    def clear(self):
+        """
+        Removes all boxes while keeping the allocated arrays.
+        :return: None
+        """
+        self.size = 0
+        self.version += 1
+        if self.grid is not None:
+            self.grid.cells = {}
+
+    def update(self, index, x1, y1, x2, y2):
+        """
+        Moves or resizes a box. The corners are normalised like in append.
+        :param index: Position of the box.
+        :param x1: X coordinate of the first corner.
+        :param y1: Y coordinate of the first corner.
+        :param x2: X coordinate of the opposite corner.
+        :param y2: Y coordinate of the opposite corner.
+        :return: None
+        """
+        if self.grid is not None:
+            self.grid.remove(index, self.coords[index].tolist())
+        self.coords[index] = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        if self.grid is not None:
+            self.grid.insert(index, self.coords[index].tolist())
+        self.version += 1
+
+    def delete(self, index):
+        """
+        Removes a box, keeping the order of the remaining boxes.
+        :param index: Position of the box.
+        :return: None
+        """
+        end = self.size
+        self.coords[index:end - 1] = self.coords[index + 1:end]
+        self.classes[index:end - 1] = self.classes[index + 1:end]
+        self.image_ids[index:end - 1] = self.image_ids[index + 1:end]
+        self.size -= 1
+        self.version += 1
+        if self.grid is not None:
+            # Positions after the deleted box shift, rebuilding is cheap next to a user action
+            self.grid.rebuild(self.coords[:self.size].tolist())
+
+    def get_box(self, index):
+        """
+        Returns one box.
+        :param index: Position of the box.
+        :return: (x1, y1, x2, y2, class) tuple.
+        """
+        return (*self.coords[index].tolist(), int(self.classes[index]))
+
+    def hit_test(self, x, y, margin=0):
+        """
+        Returns the box under a point. Nested boxes resolve to the smallest one.
+        :param x: X coordinate of the point.
+        :param y: Y coordinate of the point.
+        :param margin: Distance outside a box edge that still counts as a hit.
+        :return: Position of the box, None if no box is hit.
+        """
+        if self.grid is not None:
+            candidates = sorted(self.grid.query(x, y, margin))
+        else:
+            candidates = range(self.size)
+
+        best, best_area = None, None
+        for index in candidates:
+            x1, y1, x2, y2 = self.coords[index].tolist()
+            if x1 - margin <= x <= x2 + margin and y1 - margin <= y <= y2 + margin:
+                area = (x2 - x1) * (y2 - y1)
+                if best is None or area <= best_area:
+                    best, best_area = index, area
+        return best
+
+    def rows(self):
+        """
+        Returns the boxes as (x1, y1, x2, y2, class) tuples of Python numbers.
+        :return: List of box tuples.
+        """
+        coords = self.coords[:self.size].tolist()
+        classes = self.classes[:self.size].tolist()
+        return [(*box, label) for box, label in zip(coords, classes)]
+
+    def to_yolo(self, width, height):
+        """
+        Converts the boxes to normalised YOLO (class, x_center, y_center, width, height) rows,
+        clipped to the image.
+        :param width: The width of the image the boxes were drawn on.
+        :param height: The height of the image the boxes were drawn on.
+        :return: Array of shape (n, 5).
+        """
+        scale = np.array([width, height], dtype=np.float64)
+        coords = np.clip(self.coords[:self.size].astype(np.float64), 0, np.tile(scale, 2))
+        yolo = np.empty((self.size, 5), dtype=np.float64)
+        yolo[:, 0] = self.classes[:self.size]
+        yolo[:, 1:3] = (coords[:, :2] + coords[:, 2:]) / 2 / scale
+        yolo[:, 3:5] = (coords[:, 2:] - coords[:, :2]) / scale
+        return yolo
+
+    def get_coords(self):
+        """
+        Returns the (x1, y1, x2, y2) corners of the boxes.
+        :return: Array of shape (n, 4).
+        """
+        return self.coords[:self.size]
+
+    def get_labels(self):
+        """
+        Returns the classes of the boxes.
+        :return: Array of classes.
+        """
+        return self.classes[:self.size]
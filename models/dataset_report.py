@@ -0,0 +1,248 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from models.image_discovery import DEFAULT_EXTENSIONS, natural_sort_key
+from models.stratification import SPLIT_NAMES
+from models.yolo_labels import empty_labels, find_invalid_rows, iter_chunks, read_labels
+
+# Upper edges of the normalised box area histogram, each bin holds the boxes up to its edge
+AREA_BINS = (0.0001, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Edges of the log2 histogram of the normalised width to height ratio, more extreme ratios count in the outer bins
+ASPECT_BINS = (-8, -3, -2, -1, -0.5, 0.5, 1, 2, 3, 8)
+ISSUE_LIMIT = 1000
+REPORT_FILENAME = "dataset_report.json"
+
+
+def find_splits(folder):
+    """
+    Finds the image and label folders of a dataset folder. A folder with train, val or test subfolders
+    is reported per split, any other folder as a single split holding images/ or scaled_images/ and labels/.
+    :param folder: The dataset or labelled folder.
+    :return: Dictionary of split name to (images folder, labels folder).
+    """
+    splits = {name: (os.path.join(folder, name, "images"), os.path.join(folder, name, "labels"))
+              for name in SPLIT_NAMES if os.path.isdir(os.path.join(folder, name))}
+    if splits:
+        return splits
+    images_folder = folder
+    for name in ("images", "scaled_images"):
+        if os.path.isdir(os.path.join(folder, name)):
+            images_folder = os.path.join(folder, name)
+            break
+    return {"all": (images_folder, os.path.join(folder, "labels"))}
+
+
+def list_stems(folder, extensions):
+    """
+    Lists the files of a folder with one of the extensions by their name without extension.
+    :param folder: The folder, may not exist.
+    :param extensions: Lower case extensions to accept.
+    :return: Dictionary of stem to path.
+    """
+    if not os.path.isdir(folder):
+        return {}
+    with os.scandir(folder) as entries:
+        return {os.path.splitext(entry.name)[0]: entry.path for entry in entries
+                if entry.is_file() and entry.name.lower().endswith(extensions)}
+
+
+def read_labels_or_errors(label_files):
+    """
+    Reads a chunk of label files without validating them, returning the errors instead of raising them.
+    :param label_files: Paths of the label files.
+    :return: List of tuples of the labels, empty on error, and the error message or None.
+    """
+    results = []
+    for label_file in label_files:
+        try:
+            results.append((read_labels(label_file, validate=False), None))
+        except (OSError, ValueError) as e:
+            results.append((empty_labels(), str(e)))
+    return results
+
+
+def histogram(values, edges):
+    """
+    Counts the values per bin.
+    :param values: Array of values.
+    :param edges: Increasing bin edges.
+    :return: Dictionary with the edges and the count of each bin.
+    """
+    counts = np.histogram(values, bins=np.asarray(edges, dtype=np.float64))[0] if len(edges) > 1 else []
+    return {"edges": [float(edge) for edge in edges], "counts": [int(count) for count in counts]}
+
+
+def add_issues(issues, key, entries):
+    """
+    Adds entries to an issue list, keeping at most ISSUE_LIMIT of them and counting the rest.
+    :param issues: Dictionary of issue name to {"count", "items"}.
+    :param key: Issue name.
+    :param entries: Entries to add.
+    :return: None
+    """
+    issue = issues.setdefault(key, {"count": 0, "items": []})
+    issue["count"] += len(entries)
+    issue["items"].extend(entries[:max(0, ISSUE_LIMIT - len(issue["items"]))])
+
+
+def scan_split(images_folder, labels_folder, known_classes, issues, executor, extensions=DEFAULT_EXTENSIONS):
+    """
+    Reads every label file of one split and computes its statistics with vectorised histograms.
+    :param images_folder: The images folder of the split.
+    :param labels_folder: The labels folder of the split.
+    :param known_classes: Sorted array of the classes of the label map, or None to accept every class.
+    :param issues: Dictionary the found issues are added to.
+    :param executor: Thread pool the label files are read on.
+    :param extensions: Lower case image extensions to accept.
+    :return: Dictionary with the statistics of the split.
+    """
+    images = list_stems(images_folder, tuple(extensions))
+    labels = list_stems(labels_folder, (".txt",))
+    unlabelled = sorted((images[stem] for stem in images.keys() - labels.keys()), key=natural_sort_key)
+    add_issues(issues, "images_without_labels", unlabelled)
+    add_issues(issues, "labels_without_images", sorted((labels[stem] for stem in labels.keys() - images.keys()),
+                                                       key=natural_sort_key))
+
+    label_files = sorted(labels.values(), key=natural_sort_key)
+    results = [result for chunk in executor.map(read_labels_or_errors, iter_chunks(label_files)) for result in chunk]
+    add_issues(issues, "malformed_label_files",
+               [{"file": file, "error": error} for file, (_, error) in zip(label_files, results) if error])
+    lengths = np.array([len(boxes) for boxes, _ in results], dtype=np.int64)
+    readable = np.array([error is None for _, error in results], dtype=bool)
+    add_issues(issues, "empty_label_files", [file for file, length, ok in zip(label_files, lengths, readable)
+                                             if ok and not length])
+
+    boxes = np.concatenate([boxes for boxes, _ in results]) if results else empty_labels()
+    files = np.repeat(np.arange(len(label_files)), lengths)
+    lines = np.arange(len(boxes)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + 1
+
+    invalid = find_invalid_rows(boxes)
+    add_issues(issues, "out_of_range_boxes", [{"file": label_files[file], "line": int(line), "box": box}
+                                              for file, line, box in zip(files[invalid].tolist(),
+                                                                         lines[invalid].tolist(),
+                                                                         boxes[invalid].tolist())])
+    classes = boxes[:, 0].astype(np.int64)
+    if known_classes is not None:
+        unknown = ~np.isin(classes, known_classes)
+        add_issues(issues, "unknown_classes", [{"file": label_files[file], "line": int(line), "class": label}
+                                               for file, line, label in zip(files[unknown].tolist(),
+                                                                            lines[unknown].tolist(),
+                                                                            classes[unknown].tolist())])
+
+    valid = boxes[~invalid]
+    widths, heights = valid[:, 3], valid[:, 4]
+    areas = widths * heights
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aspects = np.log2(widths / heights)
+    class_values, class_counts = np.unique(classes, return_counts=True)
+    # Images without a label file have no boxes
+    per_image = np.bincount(lengths[readable], minlength=1) if readable.any() else np.zeros(1, dtype=np.int64)
+    per_image[0] += len(unlabelled)
+    return {
+        "images": len(images),
+        "label_files": len(label_files),
+        "boxes": int(len(boxes)),
+        "class_counts": {str(label): int(count) for label, count in zip(class_values.tolist(), class_counts)},
+        "boxes_per_image": {str(count): images for count, images in enumerate(per_image.tolist()) if images},
+        "box_area": histogram(areas, (0.0,) + AREA_BINS),
+        "aspect_log2": histogram(np.clip(aspects[np.isfinite(aspects)], ASPECT_BINS[0], ASPECT_BINS[-1]),
+                                 ASPECT_BINS),
+    }
+
+
+def get_imbalance(class_counts):
+    """
+    Returns how unbalanced the classes are.
+    :param class_counts: Dictionary of class to number of boxes.
+    :return: Dictionary with the most and least frequent class and the ratio of their counts.
+    """
+    if not class_counts:
+        return {}
+    most = max(class_counts, key=class_counts.get)
+    least = min(class_counts, key=class_counts.get)
+    return {"most_frequent": most, "least_frequent": least,
+            "ratio": class_counts[most] / class_counts[least]}
+
+
+def build_report(folder, label_map=None, workers=None, extensions=DEFAULT_EXTENSIONS):
+    """
+    Scans a dataset or labelled folder and reports its statistics and problems. The label files are
+    read on a thread pool and all boxes of a split are checked and counted in single vectorised passes.
+    :param folder: The dataset or labelled folder.
+    :param label_map: Optional dictionary of class id to name, classes outside it are reported as unknown.
+    :param workers: Number of reader threads, defaults to the number of CPUs.
+    :param extensions: Lower case image extensions to accept.
+    :return: The report as a JSON serialisable dictionary.
+    """
+    known_classes = np.array(sorted(int(label) for label in label_map), dtype=np.int64) if label_map else None
+    issues = {}
+    splits = {}
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, (images_folder, labels_folder) in find_splits(folder).items():
+            splits[name] = scan_split(images_folder, labels_folder, known_classes, issues, executor, extensions)
+
+    totals = {}
+    for split in splits.values():
+        for label, count in split["class_counts"].items():
+            totals[label] = totals.get(label, 0) + count
+    for key in ("images_without_labels", "labels_without_images", "malformed_label_files", "empty_label_files",
+                "out_of_range_boxes", "unknown_classes"):
+        issues.setdefault(key, {"count": 0, "items": []})
+    return {
+        "folder": os.path.abspath(folder),
+        "images": sum(split["images"] for split in splits.values()),
+        "boxes": sum(split["boxes"] for split in splits.values()),
+        "class_counts": dict(sorted(totals.items(), key=lambda item: int(item[0]))),
+        "imbalance": get_imbalance(totals),
+        "splits": splits,
+        "issues": issues,
+    }
+
+
+def count_issues(report):
+    """
+    Returns the total number of problems found.
+    :param report: The report.
+    :return: Number of issues.
+    """
+    return sum(issue["count"] for issue in report["issues"].values())
+
+
+def summarize_report(report, label_map=None):
+    """
+    Describes the report in a few human readable lines.
+    :param report: The report.
+    :param label_map: Optional dictionary of class id to name.
+    :return: The summary text.
+    """
+    names = {str(label): name for label, name in (label_map or {}).items()}
+    lines = [f"{report['images']} images, {report['boxes']} boxes in {', '.join(report['splits'])}"]
+    for label, count in report["class_counts"].items():
+        per_split = ", ".join(f"{name} {split['class_counts'].get(label, 0)}"
+                              for name, split in report["splits"].items())
+        lines.append(f"  {names.get(label, label)}: {count} ({per_split})")
+    if report["imbalance"]:
+        lines.append(f"Most to least frequent class ratio: {report['imbalance']['ratio']:.1f}")
+    for key, issue in report["issues"].items():
+        if issue["count"]:
+            lines.append(f"{key.replace('_', ' ').capitalize()}: {issue['count']}")
+    if not count_issues(report):
+        lines.append("No problems found")
+    return "\n".join(lines)
+
+
+def write_report(report, path):
+    """
+    Writes the report as JSON.
+    :param report: The report.
+    :param path: Path of the report file.
+    :return: None
+    """
+    partial_path = path + ".part"
+    with open(partial_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(partial_path, path)
@@ -0,0 +1,62 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from models.dataset_report import find_splits, list_stems, read_labels_or_errors
+from models.image_discovery import DEFAULT_EXTENSIONS, natural_sort_key
+from models.label_index import LabelIndex
+from models.stratification import SPLIT_NAMES
+from models.yolo_labels import find_invalid_rows, iter_chunks
+
+
+def index_existing_labels(folder, extensions=DEFAULT_EXTENSIONS, workers=None):
+    """
+    Indexes a folder that already holds YOLO labels, so it can be labeled again in place. Every images folder
+    is scanned once and its images are paired with the label files of the same stem. The classes of the label
+    files of a dataset with splits are read in one parallel pass, to count the splits. Without splits the label
+    files are only read when their image is visited, their classes are None until then. Label files that can't
+    be read or hold invalid boxes don't stop the indexing, they are counted by their valid boxes and returned.
+    :param folder: A dataset folder with train, val and test splits, or a folder with images and labels/.
+    :param extensions: Lower case image extensions to accept.
+    :param workers: Number of reader threads, defaults to the number of CPUs.
+    :return: The image paths, for every image a journal record as if it was saved to its current files, and the
+             problems of the label files with errors, one message naming the file each.
+    """
+    image_paths = []
+    records = []
+    labeled = []
+    for split, (images_folder, labels_folder) in find_splits(folder).items():
+        images = list_stems(images_folder, tuple(extensions))
+        labels = list_stems(labels_folder, (".txt",))
+        for stem in sorted(images, key=natural_sort_key):
+            record = {
+                "type": "saved",
+                "index": len(image_paths),
+                "image": images[stem],
+                "split": split if split in SPLIT_NAMES else None,
+                "labels": [],
+                "image_file": images[stem],
+                "label_file": labels.get(stem, os.path.join(labels_folder, stem + ".txt")),
+            }
+            if stem in labels:
+                record["labels"] = None
+                if record["split"]:
+                    labeled.append(record)
+            image_paths.append(images[stem])
+            records.append(record)
+
+    label_files = [record["label_file"] for record in labeled]
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as executor:
+        results = [result for chunk in executor.map(read_labels_or_errors, iter_chunks(label_files))
+                   for result in chunk]
+    file_labels = []
+    problems = []
+    for label_file, (labels, error) in zip(label_files, results):
+        invalid = find_invalid_rows(labels)
+        if error or invalid.any():
+            problems.append(error or f"{label_file}: {int(invalid.sum())} invalid box(es)")
+        file_labels.append(labels[~invalid])
+
+    label_index = LabelIndex.from_labels(label_files, file_labels)
+    for record, presence in zip(labeled, label_index.presence):
+        record["labels"] = label_index.classes[presence].tolist()
+    return image_paths, records, problems
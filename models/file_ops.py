@@ -0,0 +1,165 @@
+import errno
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from models.metrics import metrics
+
+
+def rename_into(file, destination_folder):
+    """
+    Moves the file into the destination folder with an atomic rename. An existing file in the destination folder
+    is never overwritten: the file is hardlinked into place, which fails if the name is taken, and then unlinked.
+    :param file: The file to move.
+    :param destination_folder: The folder to move the file into.
+    :return: True if the file was renamed, False if it is on another device and has to be copied.
+    """
+    destination = os.path.join(destination_folder, os.path.basename(file))
+    try:
+        os.link(file, destination)
+    except FileExistsError:
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination) from None
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            return False
+        # The filesystem has no hardlinks, check the name before the rename instead
+        if os.path.lexists(destination):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination) from None
+        os.replace(file, destination)
+        return True
+    os.remove(file)
+    return True
+
+
+def copy_into(file, destination_folder):
+    """
+    Copies the file into the destination folder and removes the source. An existing file is not overwritten.
+    :param file: The file to move.
+    :param destination_folder: The folder to move the file into.
+    :return: None
+    """
+    destination = os.path.join(destination_folder, os.path.basename(file))
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination)
+    partial = destination + ".part"
+    shutil.copy2(file, partial)
+    os.replace(partial, destination)
+    os.remove(file)
+
+
+def move_files(files, destination_folder, workers=8, progress=None):
+    """
+    Moves the files into the destination folder. Files on the same filesystem are renamed,
+    files on another device are copied on a thread pool.
+    :param files: The files to move.
+    :param destination_folder: The folder to move the files into.
+    :param workers: Number of copy threads.
+    :param progress: Optional callback called with (moved, total) after each file.
+    :return: None
+    """
+    files = list(files)
+    total = len(files)
+    os.makedirs(destination_folder, exist_ok=True)
+
+    moved = 0
+    cross_device = []
+    for file in files:
+        if rename_into(file, destination_folder):
+            moved += 1
+            metrics.increment("files_moved")
+            if progress:
+                progress(moved, total)
+        else:
+            cross_device.append(file)
+
+    if not cross_device:
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_into, file, destination_folder) for file in cross_device]
+        for future in as_completed(futures):
+            future.result()
+            moved += 1
+            metrics.increment("files_moved")
+            metrics.increment("files_copied_across_devices")
+            if progress:
+                progress(moved, total)
+
+
+def copy_files(files, destination_folder, workers=8, progress=None, names=None):
+    """
+    Copies the files into the destination folder on a thread pool, keeping the sources.
+    :param files: The files to copy.
+    :param destination_folder: The folder to copy the files into.
+    :param workers: Number of copy threads.
+    :param progress: Optional callback called with (copied, total) after each file.
+    :param names: Optional file names of the copies, defaults to the names of the files.
+    :return: The paths of the copies, in the order of the files.
+    """
+    files = list(files)
+    os.makedirs(destination_folder, exist_ok=True)
+    names = names or [os.path.basename(file) for file in files]
+    copies = [os.path.join(destination_folder, name) for name in names]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for copied, _ in enumerate(executor.map(shutil.copy2, files, copies), start=1):
+            if progress:
+                progress(copied, len(files))
+    return copies
+
+
+def claim_unique_stem(claimed, path):
+    """
+    Returns the stem to save a source file under: its own stem unless another source, from a subfolder or with
+    another extension, already claimed it, then the first free numbered variant.
+    :param claimed: Dictionary of claimed stem to the source that claimed it, updated in place.
+    :param path: The source file.
+    :return: The file stem.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name, suffix = stem, 1
+    while claimed.setdefault(name, path) != path:
+        name = f"{stem}_{suffix}"
+        suffix += 1
+    return name
+
+
+def reflink(source, destination):
+    """
+    Creates a copy-on-write clone of the source file. Only supported on Linux filesystems with FICLONE,
+    such as Btrfs and XFS.
+    :param source: The file to clone.
+    :param destination: The path of the new file.
+    :return: None
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    import fcntl
+    ficlone = 0x40049409
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), ficlone, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def link_or_copy(source, destination):
+    """
+    Materialises the source file at the destination without decoding it: a hardlink if possible,
+    else a reflink, else a plain copy.
+    :param source: The file to link.
+    :param destination: The path of the new file.
+    :return: None
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    for materialise in (os.link, reflink):
+        try:
+            materialise(source, destination)
+            metrics.increment("files_linked")
+            return
+        except OSError:
+            continue
+    shutil.copy2(source, destination)
+    metrics.increment("bytes_copied", os.path.getsize(destination))
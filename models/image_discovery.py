@@ -0,0 +1,109 @@
+import os
+import re
+import threading
+
+DEFAULT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+
+
+def natural_sort_key(name):
+    """
+    Returns a sort key that orders numbers inside names by value, e.g. img2 before img10.
+    :param name: File or folder name
+    :return: Sort key
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def iter_image_paths(folder, recursive=False, extensions=DEFAULT_EXTENSIONS):
+    """
+    Yields the image paths of a folder in natural order using os.scandir, one folder at a time.
+    Hidden folders, like the pre-scale cache, are skipped.
+    :param folder: The folder to search
+    :param recursive: True to include subfolders
+    :param extensions: Lower case image extensions to accept
+    :return: Generator of image paths
+    """
+    extensions = tuple(extensions)
+    files, folders = [], []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                files.append(entry.name)
+            elif recursive and entry.is_dir() and not entry.name.startswith("."):
+                folders.append(entry.name)
+
+    for name in sorted(files, key=natural_sort_key):
+        yield os.path.join(folder, name)
+    for name in sorted(folders, key=natural_sort_key):
+        yield from iter_image_paths(os.path.join(folder, name), recursive, extensions)
+
+
+class StreamingPathList:
+    """
+    This class is responsible for exposing a stream of image paths as a list that fills up on a background thread,
+    so the first image can be shown while the rest is still being enumerated.
+    """
+    def __init__(self, paths, source=None):
+        self.paths = []
+        self.source = source
+        self.done = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.collect, args=(iter(paths),), name="discovery", daemon=True)
+        self.thread.start()
+
+    def collect(self, paths):
+        """
+        Background loop that appends the discovered paths.
+        :param paths: Iterator of image paths
+        :return: None
+        """
+        try:
+            for path in paths:
+                with self.condition:
+                    self.paths.append(path)
+                    self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def has_index(self, index):
+        """
+        Returns True if a path exists at the index, waiting until it is discovered or discovery ends.
+        :param index: Index of the path
+        :return: True if the path exists
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.paths) > index or self.done)
+            return len(self.paths) > index
+
+    def is_complete(self):
+        """
+        Returns True if every path has been discovered.
+        :return: True if discovery has finished
+        """
+        return self.done
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Slices never wait, they return the paths discovered so far
+            with self.condition:
+                return self.paths[index]
+        if index < 0:
+            self.has_index(float("inf"))
+        elif not self.has_index(index):
+            raise IndexError(index)
+        return self.paths[index]
+
+    def __len__(self):
+        self.has_index(float("inf"))
+        return len(self.paths)
+
+    def __bool__(self):
+        return self.has_index(0)
+
+    def __iter__(self):
+        index = 0
+        while self.has_index(index):
+            yield self.paths[index]
+            index += 1
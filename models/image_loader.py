@@ -0,0 +1,44 @@
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader
+
+from models.metrics import metrics
+
+# Part of the scaled image cache key, change it when the scaling output changes
+SCALING_MODE = "ignore_aspect_decode_scaled_exif"
+
+
+def load_scaled_image(path, size, cache=None):
+    """
+    Loads the image from disk at the given display size, upright according to its EXIF orientation.
+    The decoder produces the display size directly, JPEG images are downscaled while decoding, so large
+    images are never held in memory at full resolution. Uses QImage so it is safe to call from worker threads.
+    :param path: Path to the image
+    :param size: Target (width, height) tuple
+    :param cache: Optional ScaledImageCache that is consulted first and filled on a miss
+    :return: Scaled QImage, null if the image could not be read
+    """
+    if cache is not None:
+        image = cache.get(path, size, SCALING_MODE)
+        if image is not None:
+            metrics.increment("scaled_cache_hits")
+            return image
+        metrics.increment("scaled_cache_misses")
+
+    with metrics.timer("decode"):
+        reader = QImageReader(path)
+        reader.setAutoTransform(True)
+        # The scaled size applies before the orientation is applied, swap it for images stored sideways
+        if reader.transformation() & QImageIOHandler.TransformationRotate90:
+            reader.setScaledSize(QSize(size[1], size[0]))
+        else:
+            reader.setScaledSize(QSize(size[0], size[1]))
+        image = reader.read()
+    if image.isNull():
+        return image
+    if (image.width(), image.height()) != tuple(size):
+        with metrics.timer("scale"):
+            image = image.scaled(size[0], size[1])
+
+    if cache is not None:
+        cache.put(path, size, SCALING_MODE, image)
+    return image
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from models.image_loader import load_scaled_image
+
+
+class ImagePrefetcher:
+    """
+    This class is responsible for decoding and scaling upcoming images on a worker pool
+    and keeping them in a bounded LRU cache.
+    """
+    def __init__(self, size, depth=4, max_bytes=256 * 1024 * 1024, workers=2, disk_cache=None):
+        self.size = size
+        self.disk_cache = disk_cache
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+    def prefetch(self, paths):
+        """
+        Schedules the given paths to be decoded and scaled in the background.
+        :param paths: The image paths to prefetch, nearest first.
+        :return: None
+        """
+        submitted = []
+        with self.lock:
+            for path in paths[:self.depth]:
+                if path in self.cache or path in self.pending:
+                    continue
+                future = self.executor.submit(load_scaled_image, path, self.size, self.disk_cache)
+                self.pending[path] = future
+                submitted.append((path, future))
+        # A finished future runs its callback right away, on_loaded takes the lock so it is released first
+        for path, future in submitted:
+            future.add_done_callback(lambda f, p=path: self.on_loaded(p, f))
+
+    def get(self, path):
+        """
+        Returns the scaled image for the given path, waiting for a pending load or loading it directly on a miss
+        or when the pending load failed.
+        :param path: Path to the image
+        :return: Scaled QImage
+        """
+        with self.lock:
+            image = self.cache.get(path)
+            if image is not None:
+                self.cache.move_to_end(path)
+                return image
+            future = self.pending.get(path)
+
+        if future is not None:
+            try:
+                return future.result()
+            except OSError:
+                # A failed background load, e.g. a full disk cache folder, is retried without the disk cache
+                pass
+        try:
+            image = load_scaled_image(path, self.size, self.disk_cache)
+        except OSError:
+            image = load_scaled_image(path, self.size)
+        self.store(path, image)
+        return image
+
+    def on_loaded(self, path, future):
+        """
+        Moves a finished background load into the cache.
+        :param path: Path to the image
+        :param future: The finished future
+        :return: None
+        """
+        with self.lock:
+            self.pending.pop(path, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.store(path, future.result())
+
+    def store(self, path, image):
+        """
+        Stores the image in the cache and evicts the least recently used images over the memory budget.
+        :param path: Path to the image
+        :param image: Scaled QImage
+        :return: None
+        """
+        if image.isNull():
+            return
+        with self.lock:
+            if path in self.cache:
+                return
+            self.cache[path] = image
+            self.cache_bytes += image.sizeInBytes()
+            while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_bytes -= evicted.sizeInBytes()
+
+    def shutdown(self):
+        """
+        Cancels pending loads, stops the worker pool and drops the cache.
+        :return: None
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
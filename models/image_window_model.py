@@ -1,23 +1,54 @@
 import os
-import tempfile
-from sklearn.model_selection import train_test_split
 import shutil
 
+import numpy as np
+
+from models import file_ops
+from models.box_store import BoxStore
+from models.image_discovery import StreamingPathList
+from models.label_index import LabelIndex
+from models.metrics import metrics
+from models.session_journal import SessionJournal
+from models.shards import export_shards
+from models.stratification import iterative_stratification, split_distribution
+from models.split_assigner import StreamingSplitAssigner
+from models.yolo_labels import format_labels, read_labels, write_labels
+
+SHARDS_FOLDER = "shards"
+
 
 class ImageWindowModel:
     """
     This class is responsible for storing the data and logic of the image window.
     """
-    def __init__(self, image_paths, label_map=None, percentages=None, dataset_folder=None):
+    def __init__(self, image_paths, label_map=None, percentages=None, dataset_folder=None, prescaled=False,
+                 original_paths=None, export_originals=False, duplicates=None, pack_shards=False, existing_source=None,
+                 prelabel_detector=None, prelabel_depth=None):
         self.image_paths = image_paths
+        self.prescaled = prescaled
+        self.original_paths = original_paths
+        self.export_originals = export_originals
+        self.duplicates = duplicates if duplicates else {}
+        self.pack_shards = pack_shards
         self.current_image_index = 0
         self.label_map = label_map if label_map else {}
         self.percentages = percentages
         self.dataset_folder = dataset_folder
-        self.rectangles = []
-        self.save_path = os.path.dirname(os.path.dirname(self.get_current_image_path()))
-        self.tmp_path = os.path.join(os.path.dirname(self.get_current_image_path()), "tmp")
-        self.tmp_path = tempfile.mkdtemp()
+        self.boxes = BoxStore(spatial_index=True)
+        self.existing_source = existing_source  # Folder and extensions of an existing dataset labeled in place
+        self.prelabel_detector = prelabel_detector  # Detector spec proposing boxes for new images, if any
+        self.prelabel_depth = prelabel_depth  # Queue depth of the detector, None for its default
+        if existing_source:
+            self.save_path = existing_source["folder"]
+        else:
+            self.save_path = os.path.dirname(os.path.dirname(self.get_current_image_path()))
+        self.split_assigner = StreamingSplitAssigner(percentages) if percentages else None
+        self.split_distribution = {}
+        self.annotations = {}  # Image path to the journal record of its last save or discard
+        self.loaded_version = self.boxes.version  # Box store version when the current image was shown
+        self.name_index = {}  # Lower case file name and stem to the first index of an image with it
+        self.output_stems = {}  # Output file stem to the image saved under it, so no two images share files
+        self.indexed_count = 0
 
     def get_next_image_path(self):
         """
@@ -26,10 +57,55 @@ class ImageWindowModel:
         """
         path = None
         self.current_image_index += 1
-        if self.current_image_index <= len(self.image_paths):
+        if self.has_image(self.current_image_index):
             path = self.image_paths[self.current_image_index]
         return path
 
+    def get_previous_image_path(self):
+        """
+        Moves to the previous image in the list of image paths.
+        :return: The path of the previous image, None if the current image is the first.
+        """
+        return self.go_to_image(self.current_image_index - 1)
+
+    def go_to_image(self, index):
+        """
+        Moves to the image at the given index.
+        :param index: The index of the image.
+        :return: The path of the image, None if there is no image at the index.
+        """
+        if index < 0 or not self.has_image(index):
+            return None
+        self.current_image_index = index
+        return self.image_paths[index]
+
+    def find_image(self, text):
+        """
+        Finds an image by its file name. An exact name, with or without extension, is looked up in the name index,
+        otherwise the first name containing the text after the current image is returned. Streamed paths are
+        searched as far as they are discovered.
+        :param text: The file name or a part of it, case insensitive.
+        :return: The index of the image, None if no image matches.
+        """
+        text = text.strip().lower()
+        if not text:
+            return None
+        paths = self.image_paths[self.indexed_count:]
+        for index, path in enumerate(paths, start=self.indexed_count):
+            name = os.path.basename(path).lower()
+            self.name_index.setdefault(name, index)
+            self.name_index.setdefault(os.path.splitext(name)[0], index)
+        self.indexed_count += len(paths)
+
+        if text in self.name_index:
+            return self.name_index[text]
+        count = self.indexed_count
+        for offset in range(1, count + 1):
+            index = (self.current_image_index + offset) % count
+            if text in os.path.basename(self.image_paths[index]).lower():
+                return index
+        return None
+
     def get_current_image_path(self):
         """
         Returns the current image path in the list of image paths.
@@ -37,12 +113,40 @@ class ImageWindowModel:
         """
         return self.image_paths[self.current_image_index]
 
+    def get_original_image_path(self):
+        """
+        Returns the source image of the current image, which differs from it when images are pre-scaled.
+        :return: The path of the source image.
+        """
+        if self.original_paths:
+            return self.original_paths[self.current_image_index]
+        return self.get_current_image_path()
+
+    def get_upcoming_image_paths(self, count):
+        """
+        Returns the paths of the images that follow the current image.
+        :param count: The maximum number of paths to return.
+        :return: The upcoming image paths, nearest first.
+        """
+        start = self.current_image_index + 1
+        return self.image_paths[start:start + count]
+
     def is_last_image(self):
         """
         Returns True if the current image is the last image in the list of image paths.
         :return: True if the current image is the last image in the list of image paths.
         """
-        return self.current_image_index >= len(self.image_paths) - 1
+        return not self.has_image(self.current_image_index + 1)
+
+    def has_image(self, index):
+        """
+        Returns True if there is an image at the given index, waiting for discovery if the paths are streamed.
+        :param index: The index of the image.
+        :return: True if there is an image at the given index.
+        """
+        if isinstance(self.image_paths, StreamingPathList):
+            return self.image_paths.has_index(index)
+        return index < len(self.image_paths)
 
     def is_create_dataset(self):
         """
@@ -53,66 +157,69 @@ class ImageWindowModel:
 
     def save_rectangle(self, rectangle, label):
         """
-        Saves the rectangle and label to the list of rectangles.
+        Saves the rectangle and label to the box store.
         :param rectangle: The rectangle to save.
         :param label: The label to save.
         :return: None
         """
-        self.rectangles.append((rectangle, label))
+        top_left, bottom_right = rectangle.topLeft(), rectangle.bottomRight()
+        self.boxes.append(top_left.x(), top_left.y(), bottom_right.x(), bottom_right.y(), int(label))
 
     def undo_last_rectangle(self):
         """
-        Removes the last rectangle from the list of rectangles.
+        Removes the last rectangle from the box store.
         :return: None
         """
-        if self.rectangles:
-            self.rectangles.pop()
+        self.boxes.pop()
 
-    def get_calculations(self, image):
+    def update_box(self, index, rectangle):
         """
-        Returns the calculations of the rectangles.
-        :return: The calculations of the rectangles.
+        Moves or resizes a box of the box store.
+        :param index: The position of the box.
+        :param rectangle: The new rectangle of the box.
+        :return: None
         """
-        outputs = []
-        for rectangle, label in self.rectangles:
-            x_center = ((rectangle.topLeft().x() + rectangle.bottomRight().x()) / 2) / image.width()
-            y_center = ((rectangle.topLeft().y() + rectangle.bottomRight().y()) / 2) / image.height()
-            width = (rectangle.bottomRight().x() - rectangle.topLeft().x()) / image.width()
-            height = (rectangle.bottomRight().y() - rectangle.topLeft().y()) / image.height()
+        top_left, bottom_right = rectangle.topLeft(), rectangle.bottomRight()
+        self.boxes.update(index, top_left.x(), top_left.y(), bottom_right.x(), bottom_right.y())
 
-            output = f"{label} {x_center} {y_center} {width} {height}"
-            outputs.append(output)
+    def delete_box(self, index):
+        """
+        Removes a box from the box store.
+        :param index: The position of the box.
+        :return: None
+        """
+        self.boxes.delete(index)
 
-        return outputs
+    def get_calculations(self, image):
+        """
+        Returns the calculations of the rectangles.
+        :param image: The displayed image the rectangles were drawn on.
+        :return: Array of shape (n, 5) with the class and the normalised YOLO box of every rectangle.
+        """
+        return self.boxes.to_yolo(image.width(), image.height())
 
-    def save_calculations(self, calculations, path):
+    def save_calculations(self, calculations, path, saver=None, filename=None):
         """
-        Saves the calculations to a text file.
-        :param calculations: The calculations to save.
+        Saves the calculations to a YOLO label file, formatted with fixed precision in one call.
+        :param calculations: The calculations to save, as returned by get_calculations.
         :param path: The path to save the calculations to.
+        :param saver: Optional WriteBehindSaver to queue the write on instead of writing directly.
+        :param filename: Name of the label file, named after the current image if not given.
         :return: None
         """
-        filename = self.get_filename(".txt")
+        filename = filename or self.get_filename(".txt")
         self.clear_data()
-        if calculations:
+        if len(calculations):
             filepath = os.path.join(path, filename)
+            if saver:
+                with metrics.timer("label_format"):
+                    content = format_labels(calculations)
+                saver.write_text(content, filepath)
+                return
             os.makedirs(path, exist_ok=True)
-            with open(filepath, "w") as f:
-                for calc in calculations:
-                    f.write(f"{calc}\n")
-
-    def calculate_percentages(self):
-        """
-        Calculates the percentages for the train, validation and test sets.
-        :return: The percentages for the train, validation and test sets.
-        """
-        r = 100 - self.percentages[0]
-
-        # Compute the split percentages for the remaining data
-        y = self.percentages[2] / r
-
-        # Convert percentages to float representation and return
-        return [1 - self.percentages[0] / 100, y]
+            with metrics.timer("label_write"):
+                written = write_labels(filepath, calculations)
+            metrics.increment("bytes_written", written)
 
     def get_filename(self, extension):
         """
@@ -124,27 +231,182 @@ class ImageWindowModel:
         filename = filename_without_extension + extension
         return filename
 
+    def get_images_save_path(self):
+        """
+        Returns the folder images are saved to when no dataset is created.
+        :return: The images save path.
+        """
+        return os.path.join(self.save_path, "images" if self.export_originals else "scaled_images")
+
     def create_save_paths(self):
         """
         Creates the save paths for the images and labels.
         :return: None
         """
-        images_path = os.path.join(self.save_path, "scaled_images")
+        images_path = self.get_images_save_path()
         labels_path = os.path.join(self.save_path, "labels")
         os.makedirs(images_path, exist_ok=True)
         os.makedirs(labels_path, exist_ok=True)
 
-    def create_tmp_paths(self):
+    def assign_split(self):
+        """
+        Assigns the current image to the train, validation or test set based on its labels.
+        :return: The name of the split and its images and labels paths.
+        """
+        split = self.split_assigner.assign(self.boxes.get_labels().tolist())
+        return (split,) + self.get_save_folders(split)
+
+    def get_save_folders(self, split=None):
+        """
+        Returns the folders an image and its labels are saved to.
+        :param split: The split of the image when a dataset is created.
+        :return: The images and labels paths.
+        """
+        if split:
+            return os.path.join(self.dataset_folder, split, "images"), os.path.join(self.dataset_folder, split, "labels")
+        return self.get_images_save_path(), os.path.join(self.save_path, "labels")
+
+    def get_output_files(self, index, images_path, labels_path):
+        """
+        Returns the files an image and its labels are saved as.
+        :param index: The index of the image.
+        :param images_path: The folder the image is saved to.
+        :param labels_path: The folder the labels are saved to.
+        :return: The image file and the label file.
+        """
+        stem = self.get_output_stem(index)
+        extension = ".jpg"
+        if self.export_originals:
+            source = self.original_paths[index] if self.original_paths else self.image_paths[index]
+            extension = os.path.splitext(source)[1].lower()
+        return os.path.join(images_path, stem + extension), os.path.join(labels_path, stem + ".txt")
+
+    def get_output_stem(self, index):
+        """
+        Returns the stem of the files an image is saved as, its own stem unless another image of the session,
+        from a subfolder or with another extension, was saved under it, then a numbered variant.
+        :param index: The index of the image.
+        :return: The file stem.
+        """
+        return file_ops.claim_unique_stem(self.output_stems, self.image_paths[index])
+
+    def get_save_target(self):
+        """
+        Decides where the current image is saved. An image saved before keeps its split and files and only its
+        labels are rewritten, with the split counts moved to its new labels. Other images are assigned a split.
+        :return: The split, the image file, the label file and True if the image file has to be written.
+        """
+        annotation = self.get_annotation()
+        if annotation and annotation["type"] == "saved":
+            self.forget_annotation(annotation)
+            if annotation["split"] and self.split_assigner:
+                self.split_assigner.add(StreamingSplitAssigner.SPLITS.index(annotation["split"]),
+                                        set(self.boxes.get_labels().tolist()))
+            return annotation["split"], annotation["image_file"], annotation["label_file"], False
+
+        split = None
+        if self.is_create_dataset():
+            # Save straight into the split the image is assigned to
+            split, images_path, labels_path = self.assign_split()
+        else:
+            self.create_save_paths()
+            images_path, labels_path = self.get_save_folders()
+        return (split,) + self.get_output_files(self.current_image_index, images_path, labels_path) + (True,)
+
+    def get_annotation(self, path=None):
+        """
+        Returns the journal record of the last save or discard of an image in this session.
+        :param path: The path of the image, the current image if not given.
+        :return: The record, None if the image was not saved or discarded yet.
+        """
+        return self.annotations.get(path if path is not None else self.get_current_image_path())
+
+    def set_annotation(self, record):
         """
-        Creates the temporary paths for the images and labels.
+        Stores the journal record of a save or discard as the annotation of its image.
+        :param record: The journal record.
         :return: None
         """
-        tmp_path = self.tmp_path
-        images_path = os.path.join(tmp_path, "images")
-        labels_path = os.path.join(tmp_path, "labels")
-        os.makedirs(tmp_path, exist_ok=True)
-        os.makedirs(images_path, exist_ok=True)
-        os.makedirs(labels_path, exist_ok=True)
+        self.annotations[record["image"]] = record
+        if record.get("label_file"):
+            self.output_stems.setdefault(os.path.splitext(os.path.basename(record["label_file"]))[0], record["image"])
+
+    def forget_annotation(self, annotation):
+        """
+        Removes a saved image from the split counts before it is saved again or discarded.
+        :param annotation: The journal record of its last save.
+        :return: None
+        """
+        if annotation["split"] and self.split_assigner:
+            self.split_assigner.remove(StreamingSplitAssigner.SPLITS.index(annotation["split"]), annotation["labels"])
+
+    def has_saved_labels(self):
+        """
+        Returns True if the current image was saved with labels that are not loaded yet.
+        :return: True if the labels of the current image have to be loaded.
+        """
+        annotation = self.get_annotation()
+        # Classes are None for existing label files that were not read yet
+        return bool(annotation) and annotation["type"] == "saved" and annotation["labels"] != [] and not len(self.boxes)
+
+    def load_annotation(self, width, height):
+        """
+        Loads the saved labels of the current image into the box store, when it is revisited,
+        and remembers the box store version so later edits mark the image as dirty.
+        :param width: The width of the displayed image.
+        :param height: The height of the displayed image.
+        :return: None
+        """
+        try:
+            if self.has_saved_labels():
+                self.boxes.extend_yolo(read_labels(self.get_annotation()["label_file"]), width, height)
+        finally:
+            # An image whose labels could not be read is left clean, so it is not overwritten
+            self.loaded_version = self.boxes.version
+
+    def can_prelabel(self):
+        """
+        Returns True if detector proposals may fill the current image, which is new and untouched.
+        :return: True if the current image can take proposals.
+        """
+        return self.get_annotation() is None and not len(self.boxes) and self.boxes.version == self.loaded_version
+
+    def add_proposals(self, proposals, width, height):
+        """
+        Fills the box store with detector proposals for the operator to accept or edit. Proposals of classes
+        outside the label map are dropped.
+        :param proposals: Array of shape (n, 5) with normalised YOLO boxes.
+        :param width: The width of the displayed image.
+        :param height: The height of the displayed image.
+        :return: The number of boxes added.
+        """
+        if self.label_map:
+            known = np.array([int(label) for label in self.label_map], dtype=np.int64)
+            proposals = proposals[np.isin(proposals[:, 0].astype(np.int64), known)]
+        self.boxes.extend_yolo(proposals, width, height)
+        self.loaded_version = self.boxes.version
+        return len(proposals)
+
+    def is_dirty(self):
+        """
+        Returns True if the current image has to be written, because it was not saved yet or was edited since.
+        :return: True if the current image is dirty.
+        """
+        annotation = self.get_annotation()
+        return not annotation or annotation["type"] != "saved" or self.boxes.version != self.loaded_version
+
+    def discard_image(self):
+        """
+        Discards the current image. An image saved before is removed from the split counts.
+        :return: The journal record of the discard.
+        """
+        annotation = self.get_annotation()
+        if annotation and annotation["type"] == "saved":
+            self.forget_annotation(annotation)
+        self.clear_data()
+        record = self.create_journal_record("discarded")
+        self.set_annotation(record)
+        return record
 
     def create_dataset_paths(self):
         """
@@ -167,98 +429,49 @@ class ImageWindowModel:
 
         return train_images_dir, train_labels_dir, val_images_dir, val_labels_dir, test_images_dir, test_labels_dir
 
-    def move_to_dataset_folder_for_exception(self, tmp_images, tmp_labels):
-        """
-        Moves the images and labels to the dataset folder.
-        :param tmp_images: The temporary images.
-        :param tmp_labels: The temporary labels.
-        :return: None
-        """
-        images_folder = os.path.join(self.dataset_folder, "images")
-        labels_folder = os.path.join(self.dataset_folder, "labels")
-        self.move_files(tmp_images, images_folder)
-        self.move_files(tmp_labels, labels_folder)
-
-    def get_tmp_labels(self):
+    def split_train_val_test(self, image_files, label_files):
         """
-        Returns the temporary label files.
-        :return: The temporary label files.
+        Splits the dataset into train, validation and test sets in one pass, parsing every label file once.
+        The achieved per-class distribution is kept in split_distribution.
+        :param image_files: The image files.
+        :param label_files: The label files, in the same order as the image files.
+        :return: The train, validation and test images and labels.
         """
-        label_dir = os.path.join(self.tmp_path, "labels")
-        label_files = [f for f in os.listdir(label_dir) if f.endswith('.txt')]
-        label_files = [os.path.join(label_dir, f) for f in label_files]
-        return label_files
+        with metrics.timer("split"):
+            label_index = LabelIndex.build(label_files)
+            assignment = iterative_stratification(label_index.presence, self.percentages)
+        self.split_distribution = split_distribution(label_index.presence, assignment, label_index.classes)
 
-    def get_tmp_images(self):
-        """
-        Returns the temporary image files.
-        :return: The temporary image files.
-        """
-        image_dir = os.path.join(self.tmp_path, "images")
-        images = [f for f in os.listdir(image_dir)]
-        images = [os.path.join(image_dir, f) for f in images]
-        return images
+        train_images, val_images, test_images = self.select_split(image_files, assignment, 3)
+        train_labels, val_labels, test_labels = self.select_split(label_files, assignment, 3)
+        return train_images, train_labels, val_images, val_labels, test_images, test_labels
 
-    def split_dataset(self, image_files, label_files, percentage):
+    @staticmethod
+    def select_split(files, assignment, count):
         """
-        Splits the dataset into train, validation and test sets.
-        :param image_files: The image files.
-        :param label_files: The label files.
-        :param percentage: The percentage to split the test data.
-        :return: The train images, test images, train labels and test labels.
+        Groups the files by the split they are assigned to.
+        :param files: The files.
+        :param assignment: The split index of every file.
+        :param count: The number of splits.
+        :return: One list of files per split.
         """
-        global_label_counts = {}
-
-        for lbl_file in label_files:
-            seen_labels_in_file = set()  # To store unique labels for this specific file
-
-            with open(lbl_file, 'r') as f:
-                lines = f.readlines()
-                for line in lines:
-                    lbl = int(line.split()[0])
-                    seen_labels_in_file.add(lbl)
-
-            # Add the unique labels from this file to the global count
-            for unique_lbl in seen_labels_in_file:
-                global_label_counts[unique_lbl] = global_label_counts.get(unique_lbl, 0) + 1
-
-        labels_appearing_once = [label for label, count in global_label_counts.items() if count == 1]
-        if labels_appearing_once:
-            print(f"The following labels appear only once: {labels_appearing_once}")
-            return None, None, None, None
-
-        # Assign single label to multilabel images based on least frequent label
-        single_labels = []
-        for lbl_file in label_files:
-            with open(lbl_file, 'r') as f:
-                labels = set(int(line.split()[0]) for line in f.readlines())
-
-                if len(labels) > 1:
-                    # If it's multilabel, assign the least frequent label among its labels
-                    least_common_label = min(labels, key=lambda label_count: global_label_counts.get(label_count, 0))
-                    single_labels.append(least_common_label)
-                else:
-                    # If it's a single label, just append it
-                    single_labels.append(list(labels)[0])
-
-        # Split dataset using the new single labels
-        train_images, test_images, train_labels, test_labels = train_test_split(
-            image_files, label_files, random_state=42, test_size=percentage, shuffle=True, stratify=single_labels)
-
-        return train_images, test_images, train_labels, test_labels
+        groups = [[] for _ in range(count)]
+        for file, split in zip(files, assignment.tolist()):
+            groups[split].append(file)
+        return groups
 
-    def move_files(self, files, destination_folder):
+    def move_files(self, files, destination_folder, progress=None):
         """
         Moves the files to the destination folder.
         :param files: The files to move.
         :param destination_folder: The destination folder to move the files to.
+        :param progress: Optional callback called with (moved, total) after each file.
         :return: None
         """
-        os.makedirs(destination_folder, exist_ok=True)
-        for file in files:
-            shutil.move(file, destination_folder)
+        file_ops.move_files(files, destination_folder, progress=progress)
 
-    def move_to_dataset_folder(self, train_images, train_labels, val_images, val_labels, test_images, test_labels):
+    def move_to_dataset_folder(self, train_images, train_labels, val_images, val_labels, test_images, test_labels,
+                               progress=None):
         """
         Moves the images and labels to the dataset folder.
         :param train_images: The train images.
@@ -267,6 +480,7 @@ class ImageWindowModel:
         :param val_labels: The validation labels.
         :param test_images: The test images.
         :param test_labels: The test labels.
+        :param progress: Optional callback called with (moved, total) over all files.
         :return: None
         """
         train_images_dir, train_labels_dir, val_images_dir, val_labels_dir, \
@@ -280,21 +494,154 @@ class ImageWindowModel:
             (test_images, test_images_dir),
             (test_labels, test_labels_dir)
         ]
+        total = sum(len(files) for files, _ in datasets)
+        done = 0
 
         # Loop through the pairs to move files
-        for files, dest_dir in datasets:
-            self.move_files(files, dest_dir)
+        with metrics.timer("move"):
+            for files, dest_dir in datasets:
+                step_progress = (lambda moved, _, offset=done: progress(offset + moved, total)) if progress else None
+                self.move_files(files, dest_dir, step_progress)
+                done += len(files)
+
+    def export_shards(self, progress=None):
+        """
+        Packs the splits of the dataset folder into a few large shards with an index, next to the split folders.
+        :param progress: Optional callback called with (packed, total) after each image.
+        :return: The path of the shard manifest.
+        """
+        with metrics.timer("pack_shards"):
+            return export_shards(self.dataset_folder, os.path.join(self.dataset_folder, SHARDS_FOLDER),
+                                 self.label_map, progress=progress)
+
+    def create_staging_path(self):
+        """
+        Creates a staging folder inside the dataset folder, so staged files reach their
+        split folders with a rename on the same filesystem instead of a copy.
+        :return: The staging path.
+        """
+        staging_path = os.path.join(self.dataset_folder, ".staging")
+        os.makedirs(staging_path, exist_ok=True)
+        return staging_path
+
+    def clear_staging(self):
+        """
+        Removes the staging folder.
+        :return: None
+        """
+        shutil.rmtree(os.path.join(self.dataset_folder, ".staging"), ignore_errors=True)
+
+    def get_journal_path(self):
+        """
+        Returns the path of the session journal, in the dataset folder or next to the saved labels.
+        :return: The path of the session journal.
+        """
+        folder = self.dataset_folder if self.is_create_dataset() else self.save_path
+        return os.path.join(folder, SessionJournal.FILENAME)
+
+    def get_metrics_path(self):
+        """
+        Returns the path the session metrics are dumped to, YOLO_LABELER_METRICS if it is set, otherwise next to
+        the session journal. Paths ending with .prom are written in the Prometheus text format.
+        :return: The path of the metrics file.
+        """
+        return os.environ.get("YOLO_LABELER_METRICS") or os.path.join(
+            os.path.dirname(self.get_journal_path()), ".yolo_metrics.json")
+
+    def get_session_header(self, resolution):
+        """
+        Returns the description of the session that is needed to resume it.
+        :param resolution: The display resolution of the images.
+        :return: Dictionary describing the session.
+        """
+        header = {
+            "label_map": self.label_map,
+            "percentages": self.percentages,
+            "dataset_folder": self.dataset_folder,
+            "resolution": resolution,
+            "prescaled": self.prescaled,
+            "original_paths": self.original_paths,
+            "export_originals": self.export_originals,
+            "duplicates": self.duplicates,
+            "pack_shards": self.pack_shards,
+            "prelabel_detector": self.prelabel_detector,
+            "prelabel_depth": self.prelabel_depth,
+        }
+        if self.existing_source:
+            # The existing labels are indexed again on resume
+            header["existing_source"] = self.existing_source
+        elif isinstance(self.image_paths, StreamingPathList) and self.image_paths.source:
+            # Discovery is deterministic, so the paths can be streamed again on resume instead of waiting for all
+            header["image_source"] = self.image_paths.source
+        else:
+            header["image_paths"] = list(self.image_paths)
+        return header
+
+    def create_journal_record(self, kind, split=None, image_file=None, label_file=None):
+        """
+        Returns the journal record of the current image. Call it before the boxes are cleared.
+        :param kind: "saved" or "discarded".
+        :param split: The split the image was saved to, if any.
+        :param image_file: The file the image was saved as, if any.
+        :param label_file: The file the labels were saved as, if any.
+        :return: Dictionary with the record.
+        """
+        return {
+            "type": kind,
+            "index": self.current_image_index,
+            "image": self.get_current_image_path(),
+            "split": split,
+            "labels": sorted(set(self.boxes.get_labels().tolist())),
+            "image_file": image_file,
+            "label_file": label_file,
+        }
+
+    def restore_from_journal(self, records):
+        """
+        Restores the image index, the annotations and the split counts from the records of a session journal.
+        The last record of an image wins, as images can be saved again or discarded after being revisited.
+        Images are matched by path, not by their index in the journal, as streamed sources are discovered again
+        and files added or removed since shift the positions. Labeling resumes at the first image without a record.
+        :param records: The journal records, the session header first.
+        :return: None
+        """
+        journaled = set()
+        for record in records[1:]:
+            self.set_annotation(record)
+            journaled.add(record["image"])
+        self.count_splits()
+        index = 0
+        while self.has_image(index) and self.image_paths[index] in journaled:
+            index += 1
+        self.current_image_index = index
+
+    def load_existing_labels(self, records):
+        """
+        Uses the labels of an existing dataset as the annotations of its images, so they are shown when an image
+        is visited and only the label files of edited images are rewritten, in place.
+        :param records: A saved record for every image, as returned by index_existing_labels.
+        :return: None
+        """
+        for record in records:
+            self.set_annotation(record)
+        self.count_splits()
 
-    def clear_temp(self):
+    def count_splits(self):
         """
-        Clears the temp files.
+        Counts the images and classes of every split from the annotations. Afterwards the counts are kept up to
+        date one image at a time as images are saved again or discarded.
         :return: None
         """
-        shutil.rmtree(self.tmp_path)
+        if not self.percentages:
+            return
+        self.split_assigner = StreamingSplitAssigner(self.percentages)
+        for record in self.annotations.values():
+            if record["type"] == "saved" and record["split"]:
+                self.split_assigner.add(StreamingSplitAssigner.SPLITS.index(record["split"]), record["labels"])
 
     def clear_data(self):
         """
         Clears the rectangles.
         :return: None
         """
-        self.rectangles = []
+        self.boxes.clear()
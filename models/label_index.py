@@ -0,0 +1,45 @@
+import numpy as np
+
+from models.yolo_labels import read_label_files
+
+
+class LabelIndex:
+    """
+    This class is responsible for holding the classes of many label files in memory,
+    as a per-file box count matrix built in one parallel pass over the files.
+    """
+    def __init__(self, label_files, classes, box_counts):
+        self.label_files = list(label_files)
+        self.classes = classes
+        self.box_counts = box_counts
+        self.presence = box_counts > 0
+
+    @classmethod
+    def build(cls, label_files, workers=None):
+        """
+        Parses and validates the label files on a thread pool and indexes their classes.
+        :param label_files: Paths of the label files.
+        :param workers: Number of reader threads, defaults to the number of CPUs.
+        :return: LabelIndex of the files.
+        """
+        label_files = list(label_files)
+        return cls.from_labels(label_files, read_label_files(label_files, workers))
+
+    @classmethod
+    def from_labels(cls, label_files, file_labels):
+        """
+        Indexes the classes of label files that are already read.
+        :param label_files: Paths of the label files.
+        :param file_labels: One array of shape (n, 5) per file, in the order of the paths.
+        :return: LabelIndex of the files.
+        """
+        label_files = list(label_files)
+        file_classes = [labels[:, 0].astype(np.int64) for labels in file_labels]
+
+        lengths = np.array([len(labels) for labels in file_classes], dtype=np.int64)
+        all_labels = np.concatenate(file_classes) if file_classes else np.zeros(0, dtype=np.int64)
+        classes, columns = np.unique(all_labels, return_inverse=True)
+        rows = np.repeat(np.arange(len(label_files)), lengths)
+        box_counts = np.zeros((len(label_files), len(classes)), dtype=np.int32)
+        np.add.at(box_counts, (rows, columns.reshape(-1)), 1)
+        return cls(label_files, classes, box_counts)
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics:
+    """
+    This class is responsible for collecting the latency of every stage of a session and counters such as
+    the bytes written, and for exporting them as JSON or Prometheus text. It is safe to use from worker threads.
+    Only the most recent max_samples latencies of a stage are kept for the quantiles.
+    """
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.totals = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """
+        Records one latency of the stage.
+        :param stage: Name of the stage
+        :param seconds: Latency in seconds
+        :return: None
+        """
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.max_samples)
+                self.totals[stage] = [0, 0.0]
+            self.samples[stage].append(seconds)
+            self.totals[stage][0] += 1
+            self.totals[stage][1] += seconds
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Records the time spent in the with block as one latency of the stage.
+        :param stage: Name of the stage
+        :return: Context manager
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, counter, value=1):
+        """
+        Adds the value to the counter.
+        :param counter: Name of the counter
+        :param value: Amount to add
+        :return: None
+        """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def reset(self):
+        """
+        Clears every latency and counter.
+        :return: None
+        """
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+            self.counters.clear()
+
+    def summary(self):
+        """
+        Returns the count, sum, quantiles and maximum of every stage in seconds, and the counters.
+        :return: Dictionary with the stages and counters
+        """
+        with self.lock:
+            samples = {stage: np.fromiter(values, dtype=np.float64) for stage, values in self.samples.items()}
+            totals = {stage: tuple(total) for stage, total in self.totals.items()}
+            counters = dict(self.counters)
+
+        stages = {}
+        for stage, values in sorted(samples.items()):
+            quantiles = np.quantile(values, QUANTILES)
+            stages[stage] = {
+                "count": totals[stage][0],
+                "sum": totals[stage][1],
+                "p50": float(quantiles[0]),
+                "p95": float(quantiles[1]),
+                "p99": float(quantiles[2]),
+                "max": float(values.max()),
+            }
+        return {"stages": stages, "counters": dict(sorted(counters.items()))}
+
+    def to_json(self):
+        """
+        Formats the summary as JSON.
+        :return: JSON text
+        """
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self, prefix="yolo_labeler"):
+        """
+        Formats the summary in the Prometheus text exposition format.
+        :param prefix: Prefix of the metric names
+        :return: Prometheus text
+        """
+        summary = self.summary()
+        lines = [f"# HELP {prefix}_stage_seconds Latency of the labelling stages.",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, values in summary["stages"].items():
+            for quantile in QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                             f'{values["p" + str(round(quantile * 100))]!r}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {values["sum"]!r}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+        for counter, value in summary["counters"].items():
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            lines.append(f"{prefix}_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes the metrics to the file, in the Prometheus text format if it ends with .prom, otherwise as JSON.
+        :param path: Path of the metrics file
+        :return: None
+        """
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        partial_path = path + ".part"
+        with open(partial_path, "w") as f:
+            f.write(text)
+        os.replace(partial_path, path)
+
+
+# Metrics of the running process, shared by the models, views and presenters
+metrics = Metrics()
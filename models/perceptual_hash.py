@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage, QImageReader
+
+from models.scaled_image_cache import get_app_cache_folder
+
+HASH_SIZE = 8
+# Number of set bits of every byte value, for Hamming distances without numpy.bitwise_count
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def dhash(path, hash_size=HASH_SIZE):
+    """
+    Computes the difference hash of an image: every bit tells whether a pixel of the grayscale thumbnail is
+    brighter than its right neighbour. The image is downscaled while decoding, so large images stay cheap.
+    :param path: Path to the image
+    :param hash_size: Rows of the thumbnail, the hash has hash_size * hash_size bits
+    :return: The hash as an integer, None if the image could not be read
+    """
+    reader = QImageReader(path)
+    reader.setScaledSize(QSize(hash_size + 1, hash_size))
+    image = reader.read()
+    if image.isNull():
+        return None
+    image = image.convertToFormat(QImage.Format_Grayscale8)
+    pixels = np.frombuffer(image.constBits().asstring(image.sizeInBytes()), dtype=np.uint8)
+    pixels = pixels.reshape(hash_size, image.bytesPerLine())[:, :hash_size + 1]
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distances(hashes, value):
+    """
+    Returns the Hamming distance of every hash to the value.
+    :param hashes: Array of uint64 hashes
+    :param value: The hash to compare to
+    :return: Array of distances
+    """
+    differences = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(value))
+    return POPCOUNT[differences.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HashCache:
+    """
+    This class is responsible for keeping the perceptual hashes of images on disk across sessions.
+    Entries are keyed by the path, size and modification time of the image and the hash size.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_app_cache_folder(), "perceptual_hashes.json")
+        self.lock = threading.Lock()
+        self.changed = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def get_key(path, hash_size):
+        """
+        Returns the cache key of an image, or None if it can't be read.
+        :param path: Path to the image
+        :param hash_size: Size of the hash
+        :return: The key
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{hash_size}"
+
+    def get(self, key):
+        """
+        Returns the cached hash of a key.
+        :param key: Cache key
+        :return: The hash, None on a miss
+        """
+        with self.lock:
+            value = self.entries.get(key)
+        return None if value is None else int(value, 16)
+
+    def put(self, key, value):
+        """
+        Stores the hash of a key.
+        :param key: Cache key
+        :param value: The hash
+        :return: None
+        """
+        with self.lock:
+            self.entries[key] = format(value, "x")
+            self.changed = True
+
+    def save(self):
+        """
+        Writes the cache to disk if it changed.
+        :return: None
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            partial_path = self.path + ".part"
+            with open(partial_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(partial_path, self.path)
+            self.changed = False
+
+
+def compute_hashes(paths, cache=None, workers=None, progress=None, hash_size=HASH_SIZE):
+    """
+    Computes the difference hashes of the images on a thread pool, reusing and filling the cache.
+    :param paths: Paths to the images
+    :param cache: Optional HashCache
+    :param workers: Number of threads, defaults to the number of CPUs
+    :param progress: Optional callback called with (done, total), on the calling thread
+    :param hash_size: Rows of the hash thumbnail
+    :return: List with the hash of every image, None for unreadable images
+    """
+    def get_hash(path):
+        key = cache.get_key(path, hash_size) if cache else None
+        value = cache.get(key) if key else None
+        if value is None:
+            value = dhash(path, hash_size)
+            if key and value is not None:
+                cache.put(key, value)
+        return value
+
+    paths = list(paths)
+    hashes = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for value in executor.map(get_hash, paths):
+            hashes.append(value)
+            if progress:
+                progress(len(hashes), len(paths))
+    if cache:
+        cache.save()
+    return hashes
+
+
+class MultiIndexHash:
+    """
+    This class is responsible for finding stored hashes within a Hamming distance of a query without comparing
+    against all of them. Hashes are cut into radius + 1 bands and indexed per band: two hashes within the radius
+    share at least one band exactly, so only the hashes sharing a band are compared.
+    """
+    def __init__(self, radius, bits=HASH_SIZE * HASH_SIZE):
+        self.radius = radius
+        edges = np.linspace(0, bits, radius + 2).astype(int)
+        self.bands = [(int(start), int(end - start)) for start, end in zip(edges[:-1], edges[1:]) if end > start]
+        self.tables = [{} for _ in self.bands]
+        self.hashes = []
+
+    def get_keys(self, value):
+        """
+        Returns the band values of a hash.
+        :param value: The hash
+        :return: One key per band
+        """
+        return [(value >> shift) & ((1 << width) - 1) for shift, width in self.bands]
+
+    def add(self, value):
+        """
+        Stores a hash.
+        :param value: The hash
+        :return: The position of the hash
+        """
+        position = len(self.hashes)
+        self.hashes.append(value)
+        for table, key in zip(self.tables, self.get_keys(value)):
+            table.setdefault(key, []).append(position)
+        return position
+
+    def query(self, value):
+        """
+        Returns the stored hash nearest to the value within the radius.
+        :param value: The hash
+        :return: The position of the nearest stored hash, None if none is within the radius
+        """
+        candidates = set()
+        for table, key in zip(self.tables, self.get_keys(value)):
+            candidates.update(table.get(key, ()))
+        if not candidates:
+            return None
+        candidates = np.fromiter(candidates, dtype=np.int64)
+        distances = hamming_distances([self.hashes[position] for position in candidates], value)
+        nearest = int(np.argmin(distances))
+        return int(candidates[nearest]) if distances[nearest] <= self.radius else None
+
+
+def find_near_duplicates(hashes, threshold):
+    """
+    Walks the images in order and marks every image within the threshold of an earlier kept image
+    as its duplicate, so the first frame of every run of near-identical frames is kept.
+    :param hashes: Hash of every image, None for images that could not be hashed and are always kept
+    :param threshold: Maximum Hamming distance of a duplicate
+    :return: List with, for every image, the index of the kept image it duplicates, or None if it is kept
+    """
+    index = MultiIndexHash(threshold)
+    kept = []
+    duplicate_of = []
+    for position, value in enumerate(hashes):
+        nearest = index.query(value) if value is not None else None
+        if nearest is None:
+            if value is not None:
+                index.add(value)
+                kept.append(position)
+            duplicate_of.append(None)
+        else:
+            duplicate_of.append(kept[nearest])
+    return duplicate_of
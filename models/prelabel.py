@@ -0,0 +1,349 @@
+import importlib
+import importlib.util
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from models.image_loader import load_scaled_image
+from models.metrics import metrics
+from models.yolo_labels import empty_labels, find_invalid_rows
+
+DEFAULT_DEPTH = 16
+DEFAULT_BATCH_SIZE = 4
+
+# The detector of a worker process, created once by init_worker
+worker_detector = None
+
+
+class StubDetector:
+    """
+    This class is responsible for proposing deterministic fake boxes without a model, for testing the
+    pre-labeling pipeline. Every image gets one to three boxes derived from its path.
+    """
+    def __init__(self, classes=1, delay=0.0):
+        self.classes = classes
+        self.delay = delay
+
+    def __call__(self, path):
+        """
+        Proposes the boxes of one image.
+        :param path: Path to the image
+        :return: Array of shape (n, 5) with normalised YOLO boxes
+        """
+        if self.delay:
+            time.sleep(self.delay)
+        rng = np.random.default_rng(zlib.crc32(path.encode("utf-8")))
+        count = int(rng.integers(1, 4))
+        sizes = rng.uniform(0.05, 0.3, (count, 2))
+        centers = rng.uniform(sizes / 2, 1 - sizes / 2)
+        return np.column_stack([rng.integers(0, self.classes, count), centers, sizes])
+
+    def detect_batch(self, paths):
+        """
+        Proposes the boxes of a batch of images.
+        :param paths: Paths to the images
+        :return: One array of shape (n, 5) per image
+        """
+        return [self(path) for path in paths]
+
+
+def non_max_suppression(boxes, scores, iou_threshold):
+    """
+    Keeps the highest scoring boxes, dropping every box that overlaps a kept box by more than the threshold.
+    :param boxes: Array of shape (n, 4) with (x1, y1, x2, y2) corners
+    :param scores: Array of n scores
+    :param iou_threshold: Maximum intersection over union of two kept boxes
+    :return: Indices of the kept boxes, highest score first
+    """
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores)
+    keep = []
+    while len(order):
+        best, order = order[0], order[1:]
+        keep.append(best)
+        top_left = np.maximum(boxes[best, :2], boxes[order, :2])
+        bottom_right = np.minimum(boxes[best, 2:], boxes[order, 2:])
+        intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=1)
+        order = order[intersection / (areas[best] + areas[order] - intersection + 1e-12) <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class OnnxDetector:
+    """
+    This class is responsible for proposing boxes with a YOLO detector exported to ONNX, run by ONNX Runtime on
+    the CPU. The model takes a (batch, 3, height, width) RGB input in [0, 1] and returns (batch, 4 + classes,
+    anchors) predictions with boxes as centers and sizes in input pixels, like Ultralytics YOLOv8 exports.
+    Images are stretched to the input size, like the displayed image, so no letterbox has to be undone.
+    """
+    def __init__(self, model_path, score_threshold=0.25, iou_threshold=0.45, threads=None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("ONNX pre-labeling needs onnxruntime, install it with pip install onnxruntime") from e
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        height, width = model_input.shape[2:4]
+        self.input_size = (width if isinstance(width, int) else 640, height if isinstance(height, int) else 640)
+        # Models exported with a fixed batch size of one are run image by image
+        self.fixed_batch = model_input.shape[0] == 1
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+
+    def preprocess(self, path):
+        """
+        Decodes an image at the input size into a CHW float array.
+        :param path: Path to the image
+        :return: Array of shape (3, height, width)
+        """
+        image = load_scaled_image(path, self.input_size)
+        if image.isNull():
+            raise OSError(f"Could not read image {path}")
+        image = image.convertToFormat(QImage.Format_RGB888)
+        width, height = self.input_size
+        pixels = np.frombuffer(image.constBits().asstring(image.sizeInBytes()), dtype=np.uint8)
+        pixels = pixels.reshape(height, image.bytesPerLine())[:, :width * 3].reshape(height, width, 3)
+        return pixels.transpose(2, 0, 1).astype(np.float32) / 255
+
+    def decode(self, output):
+        """
+        Converts the predictions of one image to normalised YOLO boxes.
+        :param output: Array of shape (4 + classes, anchors)
+        :return: Array of shape (n, 5)
+        """
+        predictions = output.T
+        class_scores = predictions[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        selected = scores >= self.score_threshold
+        centers = predictions[selected, :2] / self.input_size
+        sizes = predictions[selected, 2:4] / self.input_size
+        classes, scores = classes[selected], scores[selected]
+        # Boxes of different classes never suppress each other, shift every class to its own region
+        corners = np.hstack([centers - sizes / 2, centers + sizes / 2]) + 2 * classes[:, None]
+        keep = non_max_suppression(corners, scores, self.iou_threshold)
+        return np.column_stack([classes[keep], centers[keep], sizes[keep]])
+
+    def detect_batch(self, paths):
+        """
+        Proposes the boxes of a batch of images.
+        :param paths: Paths to the images
+        :return: One array of shape (n, 5) per image
+        """
+        inputs = np.stack([self.preprocess(path) for path in paths])
+        if self.fixed_batch:
+            outputs = [self.session.run(None, {self.input_name: batch[None]})[0][0] for batch in inputs]
+        else:
+            outputs = self.session.run(None, {self.input_name: inputs})[0]
+        return [self.decode(output) for output in outputs]
+
+
+def load_detector(spec):
+    """
+    Creates the detector described by a spec: "stub" or "stub:<delay seconds>", "onnx:<model path>", or
+    "<module>:<attribute>" naming a callable that takes an image path and returns (class, x_center, y_center,
+    width, height) rows. A class is instantiated without arguments. Objects with a detect_batch method are
+    given whole batches.
+    :param spec: The detector spec
+    :return: Function of a list of image paths returning one box array per image
+    """
+    kind, _, argument = spec.partition(":")
+    if kind == "stub":
+        detector = StubDetector(delay=float(argument or 0))
+    elif kind == "onnx":
+        detector = OnnxDetector(argument)
+    else:
+        if not argument:
+            raise ValueError(f"Invalid detector {spec}, expected stub, onnx:<model path> or <module>:<callable>")
+        detector = getattr(importlib.import_module(kind), argument)
+        if isinstance(detector, type):
+            detector = detector()
+    if hasattr(detector, "detect_batch"):
+        return detector.detect_batch
+    return lambda paths: [detector(path) for path in paths]
+
+
+def check_detector(spec):
+    """
+    Checks that the detector of a spec can be created in a worker process, without loading a model.
+    A callable spec imports its module to check that the callable exists.
+    :param spec: The detector spec
+    :return: None
+    """
+    kind, _, argument = spec.partition(":")
+    if kind == "stub":
+        float(argument or 0)
+    elif kind == "onnx":
+        if importlib.util.find_spec("onnxruntime") is None:
+            raise ImportError("ONNX pre-labeling needs onnxruntime, install it with pip install onnxruntime")
+        if not argument:
+            raise ValueError("Give the ONNX model as onnx:<model path>")
+    else:
+        if not argument:
+            raise ValueError(f"Invalid detector {spec}, expected stub, onnx:<model path> or <module>:<callable>")
+        try:
+            module = importlib.import_module(kind)
+        except ImportError as e:
+            raise ValueError(f"Could not import the detector module {kind}: {e}") from e
+        if not callable(getattr(module, argument, None)):
+            raise ValueError(f"The detector module {kind} has no callable {argument}")
+
+
+def clean_proposals(boxes):
+    """
+    Converts the output of a detector to valid YOLO rows, clipped to the image, dropping invalid boxes.
+    :param boxes: Array-like of (class, x_center, y_center, width, height) rows
+    :return: Array of shape (n, 5)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if not boxes.size:
+        return empty_labels()
+    boxes = boxes.reshape(-1, 5)
+    corners = np.clip(np.hstack([boxes[:, 1:3] - boxes[:, 3:5] / 2, boxes[:, 1:3] + boxes[:, 3:5] / 2]), 0, 1)
+    boxes = np.column_stack([np.round(boxes[:, 0]), (corners[:, :2] + corners[:, 2:]) / 2,
+                             corners[:, 2:] - corners[:, :2]])
+    return boxes[~find_invalid_rows(boxes) & (boxes[:, 3] > 0) & (boxes[:, 4] > 0)]
+
+
+def init_worker(spec):
+    """
+    Creates the detector of a worker process.
+    :param spec: The detector spec
+    :return: None
+    """
+    global worker_detector
+    worker_detector = load_detector(spec)
+
+
+def detect_batch(paths):
+    """
+    Proposes the boxes of a batch of images with the detector of the worker process.
+    :param paths: Paths to the images
+    :return: One array of shape (n, 5) per image
+    """
+    return [clean_proposals(boxes) for boxes in worker_detector(paths)]
+
+
+class Prelabeler:
+    """
+    This class is responsible for running a detector ahead of the image being labeled. Batches of upcoming
+    images are proposed on a process pool, so inference never runs on the GUI thread, and finished proposals
+    are kept until their image is shown. At most depth images are queued at a time.
+    """
+    def __init__(self, spec, depth=DEFAULT_DEPTH, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+        self.depth = depth
+        self.batch_size = batch_size
+        self.max_results = 4 * depth
+        self.results = OrderedDict()
+        self.pending = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        # Spawn the workers, forking a process that runs a Qt application can deadlock
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=init_worker, initargs=(spec,))
+
+    def schedule(self, paths):
+        """
+        Queues the images that have no proposals yet, nearest first, while fewer than depth images are queued.
+        :param paths: The current and upcoming image paths, nearest first
+        :return: None
+        """
+        submitted = []
+        with self.lock:
+            batch = []
+            for path in paths:
+                if len(self.pending) + len(batch) >= self.depth:
+                    break
+                if path in self.results or path in self.pending or path in batch:
+                    continue
+                batch.append(path)
+                if len(batch) == self.batch_size:
+                    submitted.append(self.submit(batch))
+                    batch = []
+            if batch:
+                submitted.append(self.submit(batch))
+        # A finished future runs its callback right away, on_done takes the lock so it is released first
+        for paths, future, start in filter(None, submitted):
+            future.add_done_callback(lambda f, paths=paths, start=start: self.on_done(paths, f, start))
+
+    def submit(self, batch):
+        """
+        Submits a batch to the process pool and marks its images as pending. Called with the lock held,
+        the caller registers on_done once the lock is released.
+        :param batch: Paths to the images
+        :return: Tuple of the paths, the future and the submit time, None if the pool is broken
+        """
+        try:
+            future = self.executor.submit(detect_batch, batch)
+        except Exception as e:
+            self.errors.append(e)
+            return None
+        for path in batch:
+            self.pending[path] = future
+        return tuple(batch), future, time.perf_counter()
+
+    def on_done(self, paths, future, start):
+        """
+        Stores the proposals of a finished batch, keeping the most recent ones.
+        :param paths: Paths to the images of the batch
+        :param future: The finished future
+        :param start: Time the batch was submitted
+        :return: None
+        """
+        with self.lock:
+            for path in paths:
+                self.pending.pop(path, None)
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+                return
+            for path, boxes in zip(paths, future.result()):
+                self.results[path] = boxes
+            while len(self.results) > self.max_results:
+                self.results.popitem(last=False)
+        metrics.observe("prelabel_batch", time.perf_counter() - start)
+        metrics.increment("images_prelabeled", len(paths))
+
+    def take(self, path):
+        """
+        Returns and forgets the proposals of an image without waiting.
+        :param path: Path to the image
+        :return: Array of shape (n, 5), None if the image has no finished proposals
+        """
+        with self.lock:
+            return self.results.pop(path, None)
+
+    def is_pending(self, path):
+        """
+        Returns True if the proposals of an image are being computed.
+        :param path: Path to the image
+        :return: True if the image is queued
+        """
+        with self.lock:
+            return path in self.pending
+
+    def take_errors(self):
+        """
+        Returns the detector errors collected since the last call.
+        :return: List of exceptions
+        """
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def shutdown(self):
+        """
+        Cancels the queued batches and stops the worker processes.
+        :return: None
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
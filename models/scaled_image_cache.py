@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtGui import QImage
+
+
+def get_app_cache_folder():
+    """
+    Returns the folder of the application caches in the user's cache directory.
+    :return: The cache folder path
+    """
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "yolo_data_labeler")
+
+
+def get_default_cache_folder():
+    """
+    Returns the default folder of the scaled image cache in the user's cache directory.
+    :return: The cache folder path
+    """
+    return os.path.join(get_app_cache_folder(), "scaled_images")
+
+
+INDEX_FILENAME = "index.json"
+
+
+class ScaledImageCache:
+    """
+    This class is responsible for keeping scaled images on disk across sessions.
+    Entries are keyed by the source path, size and modification time together with the target
+    resolution and scaling mode, and the least recently used entries are evicted over the size cap.
+    The usage order is kept in an index file next to the entries rather than in their modification times,
+    as entries are hardlinked into datasets and touching them would touch the dataset files too.
+    """
+    def __init__(self, folder=None, max_bytes=2 * 1024 ** 3):
+        self.folder = folder or get_default_cache_folder()
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.changed = False
+        os.makedirs(self.folder, exist_ok=True)
+        self.entries = self.load_index()
+        self.total_bytes = sum(self.entries.values())
+
+    def load_index(self):
+        """
+        Returns the entries of the cache folder in usage order. Entries missing from the index, written by a
+        session that did not save it, are taken as the most recently used in the order they were written.
+        :return: Ordered dictionary of entry name to size, least recently used first
+        """
+        found = {entry.name: entry.stat() for entry in os.scandir(self.folder) if entry.name.endswith(".jpg")}
+        try:
+            with open(os.path.join(self.folder, INDEX_FILENAME)) as f:
+                names = json.load(f)
+        except (OSError, ValueError):
+            names = []
+        entries = OrderedDict((name, found.pop(name).st_size) for name in names if name in found)
+        for name, stat in sorted(found.items(), key=lambda item: item[1].st_mtime):
+            entries[name] = stat.st_size
+        return entries
+
+    def get_entry_path(self, path, size, mode):
+        """
+        Returns the cache file path for a source image, or None if the source can't be read.
+        :param path: Path to the source image
+        :param size: Target (width, height) tuple
+        :param mode: Name of the scaling mode
+        :return: Path of the cache entry
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{size[0]}x{size[1]}|{mode}"
+        return os.path.join(self.folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jpg")
+
+    def lookup(self, path, size, mode):
+        """
+        Returns the cache file of a source image if it is cached and marks it as recently used.
+        :param path: Path to the source image
+        :param size: Target (width, height) tuple
+        :param mode: Name of the scaling mode
+        :return: Path of the cache entry, None on a miss
+        """
+        entry_path = self.get_entry_path(path, size, mode)
+        if entry_path is None:
+            return None
+        name = os.path.basename(entry_path)
+        with self.lock:
+            if name not in self.entries:
+                return None
+            if not os.path.exists(entry_path):
+                self.total_bytes -= self.entries.pop(name)
+                return None
+            self.entries.move_to_end(name)
+            self.changed = True
+        return entry_path
+
+    def get(self, path, size, mode):
+        """
+        Returns the cached scaled image of a source image.
+        :param path: Path to the source image
+        :param size: Target (width, height) tuple
+        :param mode: Name of the scaling mode
+        :return: QImage, None on a miss
+        """
+        entry_path = self.lookup(path, size, mode)
+        if entry_path is None:
+            return None
+        image = QImage(entry_path)
+        return None if image.isNull() else image
+
+    def put(self, path, size, mode, image):
+        """
+        Stores the scaled image of a source image and evicts old entries over the size cap.
+        :param path: Path to the source image
+        :param size: Target (width, height) tuple
+        :param mode: Name of the scaling mode
+        :param image: The scaled QImage
+        :return: None
+        """
+        entry_path = self.get_entry_path(path, size, mode)
+        if entry_path is None:
+            return
+        partial_path = f"{entry_path}.{threading.get_ident()}.part"
+        if not image.save(partial_path, "JPG"):
+            return
+        os.replace(partial_path, entry_path)
+        name = os.path.basename(entry_path)
+        size = os.path.getsize(entry_path)
+        with self.lock:
+            # An overwritten entry no longer takes its old size
+            self.total_bytes += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            self.changed = True
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is below 90% of its cap. Called with the lock held.
+        :return: None
+        """
+        while self.entries and self.total_bytes > self.max_bytes * 0.9:
+            name, size = self.entries.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Keep the entry that could not be removed, as the most recently used so eviction moves on
+                self.entries[name] = size
+                break
+            self.total_bytes -= size
+
+    def save(self):
+        """
+        Writes the usage order of the entries to the index file if it changed.
+        :return: None
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            index_path = os.path.join(self.folder, INDEX_FILENAME)
+            partial_path = index_path + ".part"
+            with open(partial_path, "w") as f:
+                json.dump(list(self.entries), f)
+            os.replace(partial_path, index_path)
+            self.changed = False
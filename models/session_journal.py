@@ -0,0 +1,94 @@
+import json
+import os
+
+
+class SessionJournal:
+    """
+    This class is responsible for the append-only journal of a labeling session.
+    The first record describes the session, every saved or discarded image adds one fsynced record.
+    """
+    FILENAME = ".yolo_session.jsonl"
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.file = open(path, mode, encoding="utf-8")
+
+    @classmethod
+    def create(cls, path, header):
+        """
+        Starts a new journal at the given path, replacing an existing one.
+        :param path: Path of the journal file
+        :param header: Dictionary describing the session
+        :return: SessionJournal
+        """
+        journal = cls(path, "w")
+        journal.append(dict(header, type="session"))
+        return journal
+
+    @classmethod
+    def open(cls, path):
+        """
+        Opens an existing journal to continue appending to it, after cutting off a torn last record from a crash
+        so the records appended next start on a line of their own.
+        :param path: Path of the journal file
+        :return: SessionJournal
+        """
+        cls.trim_torn_record(path)
+        return cls(path, "a")
+
+    @staticmethod
+    def trim_torn_record(path, chunk_size=64 * 1024):
+        """
+        Truncates the journal after its last complete, newline terminated, line.
+        :param path: Path of the journal file
+        :param chunk_size: Number of bytes read at a time, from the end of the file
+        :return: None
+        """
+        with open(path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - chunk_size)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b"\n")
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position != end:
+                f.truncate(position)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def read(path):
+        """
+        Reads the records of a journal. A torn record from a crash is skipped, the records after it are kept.
+        :param path: Path of the journal file
+        :return: List of record dictionaries, the session header first
+        """
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def append(self, record):
+        """
+        Appends a record and makes it durable before returning.
+        :param record: Dictionary to append
+        :return: None
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """
+        Closes the journal file.
+        :return: None
+        """
+        self.file.close()
@@ -1,6 +1,11 @@
 import os
 import json
 
+from models.existing_labels import index_existing_labels
+from models.image_discovery import DEFAULT_EXTENSIONS, StreamingPathList, iter_image_paths
+from models.perceptual_hash import HashCache, compute_hashes, find_near_duplicates
+from models.shards import MANIFEST_FILENAME
+
 
 class SetupModel:
 
@@ -10,6 +15,8 @@ class SetupModel:
         self.next_label = 0
         self.images_folder_path = ""
         self.dataset_folder_path = ""
+        self.recursive = False
+        self.extensions = DEFAULT_EXTENSIONS
 
     def add_label(self, description):
         """
@@ -62,13 +69,71 @@ class SetupModel:
         """
         self.images_folder_path = folder
 
+    def set_discovery_options(self, recursive, extensions):
+        """
+        Sets how images are searched in the images folder
+        :param recursive: True to include subfolders
+        :param extensions: Image extensions to accept, with or without the leading dot
+        :return: None
+        """
+        self.recursive = recursive
+        self.extensions = tuple('.' + extension.strip().lstrip('.').lower() for extension in extensions
+                                if extension.strip()) or DEFAULT_EXTENSIONS
+
     def get_image_paths(self):
         """
-        Returns a list of paths of images in the images folder
-        :return: A list of paths of images in the images folder
+        Returns the paths of images in the images folder in natural order, streamed while the folder is scanned
+        :return: A StreamingPathList of paths of images in the images folder
+        """
+        source = {"folder": self.images_folder_path, "recursive": self.recursive,
+                  "extensions": list(self.extensions)}
+        return self.stream_image_paths(source)
+
+    @staticmethod
+    def stream_image_paths(source):
+        """
+        Starts streaming the image paths described by a discovery source
+        :param source: Dictionary with the folder, recursive and extensions options
+        :return: A StreamingPathList of image paths
+        """
+        return StreamingPathList(iter_image_paths(source["folder"], source["recursive"], source["extensions"]),
+                                 source)
+
+    def index_existing_labels(self, folder, extensions=None):
+        """
+        Indexes the images and existing YOLO labels of a folder to label it again in place
+        :param folder: A dataset folder with splits or a folder with images and labels
+        :param extensions: Image extensions to accept, the discovery extensions if not given
+        :return: The image paths, a saved journal record for every image and the label files with problems
+        """
+        return index_existing_labels(folder, tuple(extensions) if extensions else self.extensions)
+
+    @staticmethod
+    def remove_near_duplicates(image_paths, max_distance, progress=None):
+        """
+        Removes the images whose perceptual hash is within the distance of an earlier image, so only the first
+        of a run of near-identical frames is labeled. Hashes are computed in parallel and cached on disk.
+        :param image_paths: The paths of the images, in labeling order
+        :param max_distance: Maximum Hamming distance between the 64 bit hashes of duplicates
+        :param progress: Optional callback called with (hashed, total) after each image
+        :return: The kept paths and a dictionary of every removed path to the kept path it duplicates
+        """
+        image_paths = list(image_paths)
+        duplicate_of = find_near_duplicates(compute_hashes(image_paths, HashCache(), progress=progress),
+                                            max_distance)
+        kept = [path for path, original in zip(image_paths, duplicate_of) if original is None]
+        duplicates = {path: image_paths[original] for path, original in zip(image_paths, duplicate_of)
+                      if original is not None}
+        return kept, duplicates
+
+    def get_prescale_folder(self, width, height):
+        """
+        Returns the folder the images are pre-scaled to, next to the images folder
+        :param width: The width of the scaled images
+        :param height: The height of the scaled images
+        :return: The path of the pre-scale folder
         """
-        return [self.images_folder_path + '/' +
-                f for f in os.listdir(self.images_folder_path) if f.endswith(('.jpg', '.png'))]
+        return os.path.join(os.path.dirname(self.images_folder_path), f".prescaled_{width}x{height}")
 
     def set_dataset_folder(self, folder):
         """
@@ -78,16 +143,26 @@ class SetupModel:
         """
         self.dataset_folder_path = folder
 
-    def create_yaml_file(self):
+    def create_yaml_file(self, shards_folder=None):
         """
         Creates a YAML file in the dataset folder
+        :param shards_folder: Folder of the packed shards relative to the dataset folder, to write dataset_shards.yaml
+                              pointing at the shards instead of dataset.yaml pointing at the image folders
         :return: None
         """
-        yaml_file_path = os.path.join(self.dataset_folder_path, 'dataset.yaml')
+        if shards_folder:
+            yaml_file_path = os.path.join(self.dataset_folder_path, 'dataset_shards.yaml')
+            splits = {split: f"{shards_folder}/{split}.index.npy" for split in ("train", "val", "test")}
+        else:
+            yaml_file_path = os.path.join(self.dataset_folder_path, 'dataset.yaml')
+            splits = {split: os.path.join(f'../{split}/images') for split in ("train", "val", "test")}
         with open(yaml_file_path, 'w') as yaml_file:
-            yaml_file.write(f"train: {os.path.join('../train/images')}\n")
-            yaml_file.write(f"val: {os.path.join('../val/images')}\n")
-            yaml_file.write(f"test: {os.path.join('../test/images')}\n\n")
+            if shards_folder:
+                yaml_file.write("format: yolo_shards\n")
+                yaml_file.write(f"manifest: {shards_folder}/{MANIFEST_FILENAME}\n")
+            yaml_file.write(f"train: {splits['train']}\n")
+            yaml_file.write(f"val: {splits['val']}\n")
+            yaml_file.write(f"test: {splits['test']}\n\n")
             yaml_file.write(f"nc: {len(self.label_map)}\n")
 
             # Write class names
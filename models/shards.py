@@ -0,0 +1,263 @@
+import json
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from models.dataset_report import find_splits, list_stems
+from models.image_discovery import DEFAULT_EXTENSIONS, natural_sort_key
+from models.yolo_labels import empty_labels, read_labels
+
+MANIFEST_FILENAME = "manifest.json"
+FORMAT_VERSION = 1
+# One record per image: the shard holding its bytes and where, and the slice of the boxes array holding its boxes
+INDEX_DTYPE = np.dtype([("shard", "<u4"), ("offset", "<u8"), ("length", "<u8"),
+                        ("box_start", "<u8"), ("box_count", "<u4")])
+
+
+def write_array(path, array):
+    """
+    Saves an array as .npy next to its destination and renames it into place.
+    :param path: Destination path ending with .npy
+    :param array: The array
+    :return: None
+    """
+    partial_path = path + ".part"
+    with open(partial_path, "wb") as f:
+        np.save(f, array)
+    os.replace(partial_path, path)
+
+
+class ShardWriter:
+    """
+    This class is responsible for packing the images and labels of one split into a few large files:
+    shards of concatenated encoded images, copied without re-encoding, one float32 array with the boxes
+    of all images and an index with the position of every image and its boxes.
+    """
+    def __init__(self, folder, split, max_shard_bytes=1024 ** 3):
+        self.folder = folder
+        self.split = split
+        self.max_shard_bytes = max_shard_bytes
+        self.records = []
+        self.boxes = []
+        self.box_count = 0
+        self.names = []
+        self.shards = []
+        self.shard = None
+        self.shard_bytes = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def open_shard(self):
+        """
+        Closes the current shard and starts the next one.
+        :return: None
+        """
+        self.close_shard()
+        name = f"{self.split}-{len(self.shards):05d}.bin"
+        self.shards.append(name)
+        self.shard = open(os.path.join(self.folder, name + ".part"), "wb")
+        self.shard_bytes = 0
+
+    def close_shard(self):
+        """
+        Flushes the current shard to disk and renames it into place.
+        :return: None
+        """
+        if self.shard is None:
+            return
+        self.shard.flush()
+        os.fsync(self.shard.fileno())
+        self.shard.close()
+        path = os.path.join(self.folder, self.shards[-1])
+        os.replace(path + ".part", path)
+        self.shard = None
+
+    def add(self, name, data, labels):
+        """
+        Appends one image and its boxes.
+        :param name: File name of the image
+        :param data: Encoded image bytes
+        :param labels: Array of shape (n, 5) with the YOLO boxes of the image
+        :return: None
+        """
+        if self.shard is None or (self.shard_bytes and self.shard_bytes + len(data) > self.max_shard_bytes):
+            self.open_shard()
+        self.records.append((len(self.shards) - 1, self.shard_bytes, len(data), self.box_count, len(labels)))
+        self.shard.write(data)
+        self.shard_bytes += len(data)
+        self.boxes.append(labels)
+        self.box_count += len(labels)
+        self.names.append(name)
+
+    def close(self):
+        """
+        Writes the last shard, the boxes, the index and the names of the split.
+        :return: Dictionary describing the split files, relative to the shard folder
+        """
+        self.close_shard()
+        prefix = os.path.join(self.folder, self.split)
+        boxes = np.concatenate(self.boxes).astype(np.float32) if self.boxes else empty_labels().astype(np.float32)
+        write_array(prefix + ".boxes.npy", boxes)
+        write_array(prefix + ".index.npy", np.array(self.records, dtype=INDEX_DTYPE))
+        with open(prefix + ".names.json", "w") as f:
+            json.dump(self.names, f)
+        return {"images": len(self.records), "boxes": int(len(boxes)), "shards": self.shards,
+                "index": f"{self.split}.index.npy", "boxes_file": f"{self.split}.boxes.npy",
+                "names": f"{self.split}.names.json"}
+
+
+def find_split_samples(images_folder, labels_folder, extensions=DEFAULT_EXTENSIONS):
+    """
+    Pairs the images of a split with their label files. Images without a label file have no boxes.
+    :param images_folder: The images folder of the split
+    :param labels_folder: The labels folder of the split
+    :param extensions: Lower case image extensions to accept
+    :return: List of (image file, label file or None) in natural order
+    """
+    images = list_stems(images_folder, tuple(extensions))
+    labels = list_stems(labels_folder, (".txt",))
+    return [(images[stem], labels.get(stem)) for stem in sorted(images, key=natural_sort_key)]
+
+
+def read_sample(sample):
+    """
+    Reads the encoded bytes and the validated boxes of one sample.
+    :param sample: Tuple of the image file and the label file or None
+    :return: Tuple of the bytes and an array of shape (n, 5)
+    """
+    image_file, label_file = sample
+    with open(image_file, "rb") as f:
+        data = f.read()
+    return data, read_labels(label_file) if label_file else empty_labels()
+
+
+def read_ahead(executor, function, items, depth):
+    """
+    Maps the function over the items on the executor, in order, with at most depth results pending,
+    so large inputs are not all held in memory at once.
+    :param executor: Executor to run the function on
+    :param function: Function of one item
+    :param items: The items
+    :param depth: Maximum number of submitted items not yet consumed
+    :return: Generator of the results in the order of the items
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def export_shards(dataset_folder, output_folder=None, label_map=None, max_shard_bytes=1024 ** 3, workers=8,
+                  progress=None):
+    """
+    Packs every split of a dataset folder into shards. Samples are read ahead on a thread pool, in order,
+    while the shards are written sequentially.
+    :param dataset_folder: The dataset folder with train, val and test splits
+    :param output_folder: Folder of the shards, defaults to shards/ in the dataset folder
+    :param label_map: Optional dictionary of class id to name stored in the manifest
+    :param max_shard_bytes: Size at which a new shard is started
+    :param workers: Number of reader threads
+    :param progress: Optional callback called with (packed, total) after each image
+    :return: Path of the manifest
+    """
+    output_folder = output_folder or os.path.join(dataset_folder, "shards")
+    splits = {name: find_split_samples(*folders) for name, folders in find_splits(dataset_folder).items()}
+    total = sum(len(samples) for samples in splits.values())
+    packed = 0
+    manifest = {"format": "yolo_shards", "version": FORMAT_VERSION,
+                "names": {str(label): name for label, name in (label_map or {}).items()}, "splits": {}}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for split, samples in splits.items():
+            writer = ShardWriter(output_folder, split, max_shard_bytes)
+            for (image_file, _), (data, labels) in zip(samples, read_ahead(executor, read_sample, samples,
+                                                                           workers * 4)):
+                writer.add(os.path.basename(image_file), data, labels)
+                packed += 1
+                if progress:
+                    progress(packed, total)
+            manifest["splits"][split] = writer.close()
+
+    manifest_path = os.path.join(output_folder, MANIFEST_FILENAME)
+    with open(manifest_path + ".part", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".part", manifest_path)
+    return manifest_path
+
+
+class ShardReader:
+    """
+    This class is responsible for random access to a packed split without copying: the shards are memory mapped,
+    the index and the boxes are memory mapped NumPy arrays, and samples are returned as views into them.
+    """
+    def __init__(self, folder, split):
+        with open(os.path.join(folder, MANIFEST_FILENAME)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard format version {self.manifest.get('version')}")
+        info = self.manifest["splits"][split]
+        self.index = np.load(os.path.join(folder, info["index"]), mmap_mode="r")
+        self.boxes = np.load(os.path.join(folder, info["boxes_file"]), mmap_mode="r")
+        with open(os.path.join(folder, info["names"])) as f:
+            self.names = json.load(f)
+        self.files = []
+        self.maps = []
+        self.shards = []
+        for name in info["shards"]:
+            f = open(os.path.join(folder, name), "rb")
+            self.files.append(f)
+            # Empty files can't be mapped, they only hold empty images
+            shard_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+            self.maps.append(shard_map)
+            self.shards.append(memoryview(shard_map if shard_map is not None else b""))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position):
+        """
+        Returns one sample without copying.
+        :param position: Position of the sample in the split
+        :return: Tuple of a memoryview of the encoded image and a read-only (n, 5) view of its boxes
+        """
+        record = self.index[position]
+        offset, length = int(record["offset"]), int(record["length"])
+        start = int(record["box_start"])
+        return (self.shards[int(record["shard"])][offset:offset + length],
+                self.boxes[start:start + int(record["box_count"])])
+
+    def get_name(self, position):
+        """
+        Returns the file name the sample was packed from.
+        :param position: Position of the sample in the split
+        :return: File name
+        """
+        return self.names[position]
+
+    def load_image(self, position):
+        """
+        Decodes the image of a sample.
+        :param position: Position of the sample in the split
+        :return: QImage
+        """
+        return QImage.fromData(bytes(self[position][0]))
+
+    def close(self):
+        """
+        Unmaps the shards and closes their files. Samples returned before must no longer be referenced.
+        :return: None
+        """
+        for shard in self.shards:
+            shard.release()
+        for shard_map in self.maps:
+            if shard_map is not None:
+                shard_map.close()
+        for f in self.files:
+            f.close()
+        self.shards, self.maps, self.files = [], [], []
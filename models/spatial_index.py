@@ -0,0 +1,69 @@
+class GridIndex:
+    """
+    This class is responsible for finding boxes near a point with a uniform grid.
+    Every box is registered in the cells it overlaps, so a lookup only checks the boxes of a few cells.
+    """
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def get_cells(self, x1, y1, x2, y2):
+        """
+        Returns the cells overlapped by an area.
+        :param x1: Left edge
+        :param y1: Top edge
+        :param x2: Right edge
+        :param y2: Bottom edge
+        :return: List of (column, row) cells
+        """
+        size = self.cell_size
+        return [(column, row)
+                for column in range(int(x1) // size, int(x2) // size + 1)
+                for row in range(int(y1) // size, int(y2) // size + 1)]
+
+    def insert(self, box_id, box):
+        """
+        Registers a box in the cells it overlaps.
+        :param box_id: Id of the box
+        :param box: (x1, y1, x2, y2) corners
+        :return: None
+        """
+        for cell in self.get_cells(*box):
+            self.cells.setdefault(cell, set()).add(box_id)
+
+    def remove(self, box_id, box):
+        """
+        Removes a box from the cells it overlaps.
+        :param box_id: Id of the box
+        :param box: (x1, y1, x2, y2) corners the box was inserted with
+        :return: None
+        """
+        for cell in self.get_cells(*box):
+            ids = self.cells.get(cell)
+            if ids:
+                ids.discard(box_id)
+                if not ids:
+                    del self.cells[cell]
+
+    def query(self, x, y, margin=0):
+        """
+        Returns the ids of the boxes registered near a point.
+        :param x: X coordinate
+        :param y: Y coordinate
+        :param margin: Distance around the point to include
+        :return: Set of candidate box ids
+        """
+        candidates = set()
+        for cell in self.get_cells(x - margin, y - margin, x + margin, y + margin):
+            candidates.update(self.cells.get(cell, ()))
+        return candidates
+
+    def rebuild(self, boxes):
+        """
+        Replaces the index content with the given boxes, ids being their positions.
+        :param boxes: Sequence of (x1, y1, x2, y2) corners
+        :return: None
+        """
+        self.cells = {}
+        for box_id, box in enumerate(boxes):
+            self.insert(box_id, box)
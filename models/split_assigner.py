@@ -0,0 +1,58 @@
+class StreamingSplitAssigner:
+    """
+    This class is responsible for assigning each saved image to the train, validation or test set
+    while labeling, keeping running per-class counts so every class stays close to the target percentages.
+    """
+    SPLITS = ("train", "val", "test")
+
+    def __init__(self, percentages):
+        self.targets = [percentage / 100 for percentage in percentages]
+        self.image_counts = [0] * len(self.SPLITS)
+        self.class_counts = {}
+
+    def assign(self, labels):
+        """
+        Assigns an image to the split whose per-class counts are furthest below target.
+        Rare classes weigh more, the image count breaks ties.
+        :param labels: The class labels of the boxes in the image.
+        :return: The name of the split.
+        """
+        labels = set(labels)
+        total_images = sum(self.image_counts) + 1
+        best_split, best_score = 0, None
+        for split, target in enumerate(self.targets):
+            if target <= 0:
+                continue
+            score = 0.0
+            for label in labels:
+                counts = self.class_counts.get(label, [0] * len(self.SPLITS))
+                total = sum(counts) + 1
+                score += (target * total - counts[split]) / total
+            image_deficit = (target * total_images - self.image_counts[split]) / total_images
+            if best_score is None or (score, image_deficit) > best_score:
+                best_split, best_score = split, (score, image_deficit)
+
+        self.add(best_split, labels)
+        return self.SPLITS[best_split]
+
+    def add(self, split, labels):
+        """
+        Records an image with the given labels in the split counts.
+        :param split: The index of the split.
+        :param labels: The unique class labels of the image.
+        :return: None
+        """
+        self.image_counts[split] += 1
+        for label in labels:
+            self.class_counts.setdefault(label, [0] * len(self.SPLITS))[split] += 1
+
+    def remove(self, split, labels):
+        """
+        Removes an image recorded with add, when it is relabeled or discarded.
+        :param split: The index of the split.
+        :param labels: The unique class labels the image was recorded with.
+        :return: None
+        """
+        self.image_counts[split] -= 1
+        for label in labels:
+            self.class_counts[label][split] -= 1
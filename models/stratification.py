@@ -0,0 +1,98 @@
+import numpy as np
+
+
+SPLIT_NAMES = ("train", "val", "test")
+
+
+def apportion(total, weights):
+    """
+    Divides a number of samples between splits in proportion to the given weights,
+    using the largest remainder method.
+    :param total: The number of samples to divide.
+    :param weights: Non-negative weight of each split.
+    :return: Integer array with the number of samples for each split.
+    """
+    weights = np.clip(np.asarray(weights, dtype=np.float64), 0, None)
+    if weights.sum() <= 0:
+        weights = np.ones_like(weights)
+    shares = weights / weights.sum() * total
+    quotas = np.floor(shares).astype(np.int64)
+    remainder = total - quotas.sum()
+    if remainder:
+        order = np.lexsort((-weights, -(shares - quotas)))
+        quotas[order[:remainder]] += 1
+    return quotas
+
+
+def iterative_stratification(presence, percentages, seed=42):
+    """
+    Assigns multi-label samples to splits with iterative stratification (Sechidis et al., 2011).
+    The label with the fewest unassigned samples is handled first and all of its samples are divided
+    at once between the splits that still need that label the most, so the loop runs once per label
+    instead of once per sample. Labels too rare to reach every split end up in the splits with the
+    largest share instead of failing the split.
+    :param presence: Boolean matrix of shape (samples, labels).
+    :param percentages: The share of each split, e.g. (70, 15, 15).
+    :param seed: Seed of the shuffle within each label.
+    :return: Array with the split index of every sample.
+    """
+    presence = np.asarray(presence, dtype=bool)
+    samples, labels = presence.shape
+    fractions = np.asarray(percentages, dtype=np.float64)
+    fractions = fractions / fractions.sum()
+    splits = len(fractions)
+    rng = np.random.default_rng(seed)
+
+    assignment = np.full(samples, -1, dtype=np.int64)
+    desired_samples = fractions * samples
+    desired_labels = np.outer(fractions, presence.sum(axis=0))
+    remaining = presence.sum(axis=0).astype(np.int64)
+
+    while remaining.any():
+        label = np.where(remaining > 0, remaining, np.iinfo(np.int64).max).argmin()
+        rows = np.flatnonzero(presence[:, label] & (assignment < 0))
+        rng.shuffle(rows)
+
+        demand = np.clip(desired_labels[:, label], 0, None)
+        if demand.sum() <= 0:
+            demand = np.clip(desired_samples, 0, None) + fractions
+        quotas = apportion(len(rows), demand)
+        chosen = np.repeat(np.arange(splits), quotas)
+        assignment[rows] = chosen
+
+        one_hot = np.zeros((len(rows), splits), dtype=np.int64)
+        one_hot[np.arange(len(rows)), chosen] = 1
+        row_labels = presence[rows].astype(np.int64)
+        desired_labels -= one_hot.T @ row_labels
+        desired_samples -= quotas
+        remaining -= row_labels.sum(axis=0)
+
+    # Samples without any label only balance the split sizes
+    rows = np.flatnonzero(assignment < 0)
+    if len(rows):
+        rng.shuffle(rows)
+        assignment[rows] = np.repeat(np.arange(splits), apportion(len(rows), desired_samples + 1e-9))
+
+    return assignment
+
+
+def split_distribution(presence, assignment, classes, split_names=SPLIT_NAMES):
+    """
+    Returns the achieved share of every class in each split.
+    :param presence: Boolean matrix of shape (samples, labels).
+    :param assignment: The split index of every sample.
+    :param classes: The class of each presence column.
+    :param split_names: The name of each split.
+    :return: Dictionary of class to {split name: fraction of the samples containing the class}.
+    """
+    presence = np.asarray(presence, dtype=bool)
+    counts = np.zeros((len(split_names), presence.shape[1]), dtype=np.int64)
+    for split in range(len(split_names)):
+        counts[split] = presence[assignment == split].sum(axis=0)
+    totals = np.maximum(counts.sum(axis=0), 1)
+
+    distribution = {}
+    for column, label in enumerate(np.asarray(classes).tolist()):
+        distribution[label] = {name: float(counts[split, column] / totals[column])
+                               for split, name in enumerate(split_names)}
+    return distribution
@@ -0,0 +1,248 @@
+import errno
+import os
+import queue
+import threading
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+
+from models.file_ops import link_or_copy
+from models.metrics import metrics
+
+
+class WriteBehindSaver:
+    """
+    This class is responsible for writing images and label files on a background thread.
+    Files are written next to their destination, fsynced one by one and atomically renamed into place.
+    Only the folder syncs are batched: each folder written to is synced once per batch of jobs.
+    """
+    def __init__(self, max_backlog=64, batch_size=16):
+        self.batch_size = batch_size
+        self.jobs = queue.Queue(maxsize=max_backlog)
+        self.errors = []
+        self.failed_since_checkpoint = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def write_image(self, image, path, image_format="JPG"):
+        """
+        Queues the image to be encoded and written to the given path.
+        Blocks while the backlog is full.
+        :param image: QImage to save
+        :param path: Destination path
+        :param image_format: Format the image is encoded with
+        :return: None
+        """
+        self.jobs.put((path, lambda partial_path: self.write_data(self.encode(image, image_format), partial_path),
+                       "image_write"))
+
+    def write_text(self, text, path):
+        """
+        Queues the text to be written to the given path.
+        Blocks while the backlog is full.
+        :param text: Text to save
+        :param path: Destination path
+        :return: None
+        """
+        self.jobs.put((path, lambda partial_path: self.write_data(text.encode("utf-8"), partial_path), "label_write"))
+
+    def link_file(self, source, path):
+        """
+        Queues the source file to be hardlinked, or copied if linking fails, to the given path.
+        Blocks while the backlog is full.
+        :param source: Existing file
+        :param path: Destination path
+        :return: None
+        """
+        self.jobs.put((path, lambda partial_path: link_or_copy(source, partial_path), "image_link"))
+
+    def remove_file(self, path):
+        """
+        Queues the file to be removed, in order with the writes queued before it. A missing file is ignored.
+        Blocks while the backlog is full.
+        :param path: File to remove
+        :return: None
+        """
+        self.jobs.put((path, None, "file_remove"))
+
+    def checkpoint(self, callback):
+        """
+        Queues a callback that runs on the writer thread once every write queued before it is on disk.
+        The callback is skipped if any of those writes failed since the previous checkpoint.
+        :param callback: Function without arguments
+        :return: None
+        """
+        self.jobs.put((None, callback, "checkpoint"))
+
+    def flush(self):
+        """
+        Waits until every queued write is on disk.
+        :return: None
+        """
+        self.jobs.join()
+
+    def close(self):
+        """
+        Flushes the queue and stops the writer thread.
+        :return: None
+        """
+        self.jobs.put(None)
+        self.thread.join()
+
+    def take_errors(self):
+        """
+        Returns the write errors collected since the last call.
+        :return: List of (path, exception) tuples.
+        """
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def run(self):
+        """
+        Writer thread loop. Collects up to batch_size queued jobs and commits them together.
+        :return: None
+        """
+        while True:
+            batch = [self.jobs.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            jobs = batch[:-1] if stop else batch
+            try:
+                self.commit(jobs)
+            except Exception as e:
+                # Keep the writer alive, flush and close would wait for it forever
+                self.add_error("batch", e)
+                self.failed_since_checkpoint = True
+            finally:
+                for _ in batch:
+                    self.jobs.task_done()
+            if stop:
+                return
+
+    def commit(self, jobs):
+        """
+        Writes the jobs to partial files, each fsynced before it is renamed into place, then fsyncs every folder
+        written to once. A folder that fails to sync is recorded as an error and fails the checkpoints of the batch.
+        :param jobs: List of (path, write, stage) tuples, write creates the file at the partial path it is given
+                     and its latency is recorded under the stage. Removals have no write function. Checkpoints
+                     have no path and run after the files of the batch are on disk.
+        :return: None
+        """
+        written = []
+        checkpoints = []
+        for path, write, stage in jobs:
+            if path is None:
+                checkpoints.append((write, self.failed_since_checkpoint))
+                self.failed_since_checkpoint = False
+                continue
+            if write is None:
+                try:
+                    os.remove(path)
+                    written.append(path)
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    self.add_error(path, e)
+                    self.failed_since_checkpoint = True
+                continue
+            partial_path = path + ".part"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with metrics.timer(stage):
+                    write(partial_path)
+                os.replace(partial_path, path)
+                written.append(path)
+            except Exception as e:
+                self.add_error(path, e)
+                self.failed_since_checkpoint = True
+                try:
+                    os.remove(partial_path)
+                except OSError:
+                    pass
+
+        synced = True
+        for folder in {os.path.dirname(path) for path in written}:
+            try:
+                with metrics.timer("folder_sync"):
+                    self.fsync_folder(folder)
+            except Exception as e:
+                self.add_error(folder, e)
+                synced = False
+        if not synced and jobs[-1][0] is not None:
+            # The writes after the last checkpoint of the batch belong to the next one
+            self.failed_since_checkpoint = True
+
+        for callback, failed in checkpoints:
+            if failed or not synced:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                self.add_error("checkpoint", e)
+
+    @staticmethod
+    def write_data(data, path):
+        """
+        Writes the bytes to the path and fsyncs the file.
+        :param data: Bytes to write
+        :param path: File path
+        :return: None
+        """
+        with open(path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.increment("bytes_written", len(data))
+
+    @staticmethod
+    def encode(image, image_format):
+        """
+        Encodes the image in memory.
+        :param image: QImage to encode
+        :param image_format: Format the image is encoded with
+        :return: Encoded bytes
+        """
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        with metrics.timer("encode"):
+            saved = image.save(buffer, image_format)
+        if not saved:
+            raise OSError(f"Could not encode image as {image_format}")
+        buffer.close()
+        return bytes(data)
+
+    @staticmethod
+    def fsync_folder(folder):
+        """
+        Flushes the folder entry so the renames survive a crash. Folders can't be synced on Windows and on some
+        network and FUSE filesystems, there it is skipped. Any other error is raised.
+        :param folder: Folder path
+        :return: None
+        """
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+        finally:
+            os.close(fd)
+
+    def add_error(self, path, error):
+        """
+        Records a failed write so the presenter can report it.
+        :param path: Destination path
+        :param error: The exception raised
+        :return: None
+        """
+        with self.lock:
+            self.errors.append((path, error))
@@ -0,0 +1,175 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+# Decimals written for the normalised coordinates, well below a pixel for images up to 100k pixels wide
+PRECISION = 6
+COLUMNS = 5
+# How far a box may overflow an image edge and still be valid: other tools round or pad boxes past the edge by up
+# to a thousandth of the image, on top of the rounding of the center and the size when written
+EDGE_TOLERANCE = 1e-3 + 2 * 10 ** -PRECISION
+# Files read by one task of the reader pool, so the pool overhead is paid per chunk instead of per file
+CHUNK_SIZE = 256
+
+
+def empty_labels():
+    """
+    Returns an empty label array.
+    :return: Array of shape (0, 5).
+    """
+    return np.zeros((0, COLUMNS), dtype=np.float64)
+
+
+def parse_labels(text, source="<labels>", validate=True):
+    """
+    Parses the content of a YOLO label file in one vectorised conversion.
+    :param text: Content of the label file, one "class x_center y_center width height" line per box.
+    :param source: Name of the file used in error messages.
+    :param validate: True to check the classes and coordinates, see validate_labels.
+    :return: Array of shape (n, 5) with the class and the normalised box of every line.
+    """
+    rows = [line.split() for line in text.splitlines()]
+    # Check every line, a short line followed by a long one has the right total but shifted fields
+    if any(len(row) not in (0, COLUMNS) for row in rows):
+        number, row = next((number, row) for number, row in enumerate(rows, 1) if len(row) not in (0, COLUMNS))
+        raise ValueError(f"{source}:{number}: expected {COLUMNS} values, got {len(row)}")
+    tokens = [token for row in rows for token in row]
+    if not tokens:
+        return empty_labels()
+    try:
+        labels = np.array(tokens, dtype=np.float64).reshape(-1, COLUMNS)
+    except ValueError as e:
+        raise ValueError(f"{source}: {e}") from None
+    if validate:
+        validate_labels(labels, source)
+    return labels
+
+
+def find_invalid_rows(labels):
+    """
+    Finds the rows whose class is not a non-negative integer or whose box does not lie within the image,
+    give or take EDGE_TOLERANCE.
+    :param labels: Array of shape (n, 5).
+    :return: Boolean array with one entry per row, True for invalid rows.
+    """
+    classes = labels[:, 0]
+    centers, sizes = labels[:, 1:3], labels[:, 3:5]
+    return ((classes < 0) | (classes != np.floor(classes))
+            | ~np.isfinite(labels).all(axis=1)
+            | (sizes < 0).any(axis=1)
+            | (centers - sizes / 2 < -EDGE_TOLERANCE).any(axis=1)
+            | (centers + sizes / 2 > 1 + EDGE_TOLERANCE).any(axis=1))
+
+
+def validate_labels(labels, source="<labels>"):
+    """
+    Checks that every class is a non-negative integer and every box lies within the image.
+    :param labels: Array of shape (n, 5).
+    :param source: Name of the file used in error messages.
+    :return: None
+    """
+    invalid = find_invalid_rows(labels)
+    if invalid.any():
+        row = int(np.argmax(invalid))
+        raise ValueError(f"{source}:{row + 1}: invalid box {labels[row].tolist()}")
+
+
+def validate_label_files(paths, file_labels):
+    """
+    Validates the labels of many files in a single vectorised pass.
+    :param paths: Paths of the label files, used in error messages.
+    :param file_labels: One array of shape (n, 5) per file.
+    :return: None
+    """
+    if not file_labels:
+        return
+    labels = np.concatenate(file_labels)
+    invalid = find_invalid_rows(labels)
+    if invalid.any():
+        row = int(np.argmax(invalid))
+        ends = np.cumsum([len(item) for item in file_labels])
+        file = int(np.searchsorted(ends, row, side="right"))
+        start = ends[file - 1] if file else 0
+        raise ValueError(f"{paths[file]}:{row - start + 1}: invalid box {labels[row].tolist()}")
+
+
+def read_labels(path, validate=True):
+    """
+    Reads a YOLO label file.
+    :param path: Path of the label file.
+    :param validate: True to check the classes and coordinates.
+    :return: Array of shape (n, 5).
+    """
+    with open(path, 'r') as f:
+        return parse_labels(f.read(), path, validate)
+
+
+def read_label_chunk(paths, validate=True):
+    """
+    Reads a chunk of YOLO label files, one task of the reader pool.
+    :param paths: Paths of the label files.
+    :param validate: True to check the classes and coordinates.
+    :return: One array of shape (n, 5) per file.
+    """
+    return [read_labels(path, validate) for path in paths]
+
+
+def iter_chunks(items, size=CHUNK_SIZE):
+    """
+    Splits the list into consecutive chunks.
+    :param items: List to split.
+    :param size: Maximum length of a chunk.
+    :return: Generator of lists.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def read_label_files(paths, workers=None, validate=True):
+    """
+    Reads many YOLO label files on a thread pool and validates them together.
+    :param paths: Paths of the label files.
+    :param workers: Number of reader threads, defaults to the number of CPUs.
+    :param validate: True to check the classes and coordinates.
+    :return: One array of shape (n, 5) per file, in the order of the paths.
+    """
+    paths = list(paths)
+    if len(paths) <= CHUNK_SIZE:
+        return read_label_chunk(paths, validate)
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        file_labels = [labels for chunk in executor.map(read_label_chunk, iter_chunks(paths), repeat(False))
+                       for labels in chunk]
+    if validate:
+        validate_label_files(paths, file_labels)
+    return file_labels
+
+
+def format_labels(labels, precision=PRECISION):
+    """
+    Formats the labels as the content of a YOLO label file with one formatting call for all boxes.
+    :param labels: Array of shape (n, 5) with the class and the normalised box of every box.
+    :param precision: Decimals of the coordinates.
+    :return: The label file content, one line per box.
+    """
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1, COLUMNS)
+    if not len(labels):
+        return ""
+    line = f"%d %.{precision}f %.{precision}f %.{precision}f %.{precision}f\n"
+    return (line * len(labels)) % tuple(labels.ravel().tolist())
+
+
+def write_labels(path, labels, precision=PRECISION):
+    """
+    Writes the labels to a YOLO label file in a single write.
+    :param path: Path of the label file.
+    :param labels: Array of shape (n, 5).
+    :param precision: Decimals of the coordinates.
+    :return: Number of bytes written.
+    """
+    data = format_labels(labels, precision).encode("utf-8")
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
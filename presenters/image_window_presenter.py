@@ -1,22 +1,54 @@
 import os
-from PyQt5.QtWidgets import QApplication, QMessageBox
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import QApplication, QMessageBox, QProgressDialog, QShortcut
+
+from models.image_loader import SCALING_MODE
+from models.image_prefetcher import ImagePrefetcher
+from models.metrics import metrics
+from models.prelabel import DEFAULT_DEPTH, Prelabeler
+from models.scaled_image_cache import ScaledImageCache
+from models.session_journal import SessionJournal
+from models.write_queue import WriteBehindSaver
 
 
 class ImageWindowPresenter:
     """
     The presenter for the ImageWindowView.
     """
-    def __init__(self, view, model):
+    def __init__(self, view, model, resume=False):
         self.view = view
         self.model = model
+        self.resume = resume
+        self.journal = None
+        self.image_cache = None if self.model.prescaled else ScaledImageCache()
+        self.view.image_cache = self.image_cache
+        self.prefetcher = ImagePrefetcher(self.view.display_size, disk_cache=self.image_cache)
+        self.saver = WriteBehindSaver()
+        self.view.boxes = self.model.boxes
+        self.prelabeler = None
+        if self.model.prelabel_detector:
+            self.prelabeler = Prelabeler(self.model.prelabel_detector, self.model.prelabel_depth or DEFAULT_DEPTH)
+        # Polls for the proposals of the shown image while they are computed, the GUI never waits for them
+        self.prelabel_timer = QTimer(self.view)
+        self.prelabel_timer.setInterval(100)
+        self.prelabel_timer.timeout.connect(self.apply_proposals)
 
         # Connect view signals to presenter methods
         self.view.next_button.clicked.connect(self.handle_next_image)
         self.view.undo_button.clicked.connect(self.handle_undo_last_rectangle)
+        self.view.delete_button.clicked.connect(self.handle_delete_selected_box)
         self.view.discard_button.clicked.connect(self.handle_discard_image)
+        self.view.previous_button.clicked.connect(self.handle_previous_image)
+        self.view.jump_input.returnPressed.connect(self.handle_jump_to_image)
 
         self.view.rectangle_added.connect(self.on_rectangle_added)
         self.view.rectangle_removed.connect(self.on_rectangle_removed)
+        self.view.box_changed.connect(self.on_box_changed)
+        self.view.box_deleted.connect(self.on_box_deleted)
+
+        self.metrics_shortcut = QShortcut(QKeySequence("Ctrl+Shift+M"), self.view)
+        self.metrics_shortcut.activated.connect(self.dump_metrics)
 
     def on_rectangle_added(self, rectangle, label):
         """
@@ -34,45 +66,139 @@ class ImageWindowPresenter:
         """
         self.model.undo_last_rectangle()
 
+    def on_box_changed(self, index, rectangle):
+        """
+        Handles the box_changed signal from the view.
+        :param index: Position of the box
+        :param rectangle: The moved or resized rectangle
+        :return: None
+        """
+        self.model.update_box(index, rectangle)
+
+    def on_box_deleted(self, index):
+        """
+        Handles the box_deleted signal from the view.
+        :param index: Position of the box
+        :return: None
+        """
+        self.model.delete_box(index)
+
+    def handle_delete_selected_box(self):
+        """
+        Handles the delete button of the view.
+        :return: None
+        """
+        self.view.delete_selected_box()
+
     def handle_next_image(self):
         """
-        Handles the next_image signal from the view.
+        Handles the next_image signal from the view. Exits on the last image.
         :return: None
         """
+        if self.model.is_last_image():
+            self.exit_app()
+            return
         self.save()
-
-        next_image_path = self.model.get_next_image_path()
-        if next_image_path:
-            self.view.set_image(next_image_path)
-            self.view.rectangles = []
-            self.view.check_next_button_status()
-            self.view.check_discard_button_status()
-        self.create_exit_button()
+        self.show_image(self.model.get_next_image_path())
 
     def handle_discard_image(self):
         """
-        Handles the discard_image signal from the view.
+        Handles the discard_image signal from the view. Exits on the last image.
         :return: None
         """
-        next_image_path = self.model.get_next_image_path()
-        if next_image_path:
-            self.view.set_image(next_image_path)
-            self.view.rectangles = []
-            self.view.check_next_button_status()
-            self.view.check_discard_button_status()
-        self.create_exit_button()
+        if self.model.is_last_image():
+            self.exit_app(True)
+            return
+        self.discard()
+        self.show_image(self.model.get_next_image_path())
+
+    def handle_previous_image(self):
+        """
+        Handles the previous button of the view.
+        :return: None
+        """
+        self.go_to_image(self.model.current_image_index - 1)
+
+    def handle_jump_to_image(self):
+        """
+        Handles the jump input of the view. A number jumps to that image, counting from 1,
+        any other text to the next image whose file name contains it.
+        :return: None
+        """
+        text = self.view.jump_input.text().strip()
+        if not text:
+            return
+        index = int(text) - 1 if text.isdigit() else self.model.find_image(text)
+        if index is None or index < 0 or not self.model.has_image(index):
+            self.show_error(f"No image matches {text}")
+            return
+        self.view.jump_input.clear()
+        self.go_to_image(index)
+
+    def go_to_image(self, index):
+        """
+        Saves the current image if it is dirty and shows the image at the given index.
+        :param index: The index of the image
+        :return: None
+        """
+        if index == self.model.current_image_index or index < 0 or not self.model.has_image(index):
+            return
+        self.save()
+        self.show_image(self.model.go_to_image(index))
 
     def save(self):
         """
-        Saves the current image and rectangle calculations.
+        Saves the current image and rectangle calculations if they changed. An image saved before is saved to
+        the same files and only its labels are rewritten, an image saved before whose boxes were all deleted
+        is discarded.
         :return: None
         """
-        if self.model.is_create_dataset():
-            self.save_tmp()
-        else:
-            self.model.create_save_paths()
-            self.save_images(os.path.join(self.model.save_path, "scaled_images"))
-            self.model.save_calculations(self.model.get_calculations(self.view.image), os.path.join(self.model.save_path, "labels"))
+        if not self.model.is_dirty():
+            self.model.clear_data()
+            metrics.increment("images_unchanged")
+            return
+        if not len(self.model.boxes):
+            annotation = self.model.get_annotation()
+            if annotation and annotation["type"] == "saved":
+                self.discard()
+            self.model.clear_data()
+            return
+
+        split, image_file, label_file, write_image = self.model.get_save_target()
+        record = self.model.create_journal_record("saved", split, image_file, label_file)
+
+        with metrics.timer("save"):
+            if write_image:
+                self.save_images(image_file)
+            self.model.save_calculations(self.model.get_calculations(self.view.image), os.path.dirname(label_file),
+                                         self.saver, os.path.basename(label_file))
+            self.model.set_annotation(record)
+            self.log_to_journal(record)
+        metrics.increment("images_saved")
+        self.report_write_errors()
+
+    def discard(self):
+        """
+        Discards the current image, removing its files if it was saved before.
+        :return: None
+        """
+        annotation = self.model.get_annotation()
+        if annotation and annotation["type"] == "saved":
+            if annotation["image_file"] != annotation["image"]:
+                # Images labeled in place stay, only their labels are removed
+                self.saver.remove_file(annotation["image_file"])
+            self.saver.remove_file(annotation["label_file"])
+        self.log_to_journal(self.model.discard_image())
+        metrics.increment("images_discarded")
+
+    def log_to_journal(self, record):
+        """
+        Appends the record to the session journal once the writes queued before it are on disk.
+        :param record: The journal record
+        :return: None
+        """
+        journal = self.journal
+        self.saver.checkpoint(lambda: journal.append(record))
 
     def handle_undo_last_rectangle(self):
         """
@@ -88,84 +214,183 @@ class ImageWindowPresenter:
         """
         initial_image_path = self.model.get_current_image_path()
         if initial_image_path:
-            self.view.set_image(initial_image_path)
+            self.show_image(initial_image_path)
 
-    def save_tmp(self):
+    def show_image(self, path):
         """
-        Saves the current image and rectangle calculations to a temporary folder.
+        Shows the image from the prefetch cache and schedules the upcoming images.
+        :param path: Path to the image
         :return: None
         """
-        tmp_path = self.model.tmp_path
-        images_path = os.path.join(tmp_path, "images")
-        labels_path = os.path.join(tmp_path, "labels")
+        with metrics.timer("show_image"):
+            self.view.set_image(path, self.prefetcher.get(path))
+        self.load_annotation()
+        self.prefetcher.prefetch(self.model.get_upcoming_image_paths(self.prefetcher.depth))
+        if self.prelabeler:
+            self.prelabeler.schedule([path] + self.model.get_upcoming_image_paths(self.prelabeler.depth))
+            self.apply_proposals()
+        self.update_navigation()
 
-        self.model.create_tmp_paths()
+    def load_annotation(self):
+        """
+        Loads the saved labels of a revisited image from its label file.
+        :return: None
+        """
+        if self.model.has_saved_labels():
+            # The label file may still be queued on the saver
+            self.saver.flush()
+        try:
+            self.model.load_annotation(self.view.image.width(), self.view.image.height())
+        except (OSError, ValueError) as e:
+            self.show_error(f"Could not load the labels of this image: {e}")
+        self.view.update()
 
-        calculations = self.model.get_calculations(self.view.image)
+    def apply_proposals(self):
+        """
+        Fills the current image with the detector proposals once they are ready, unless the image was saved
+        before or already has boxes. Keeps polling while they are computed.
+        :return: None
+        """
+        errors = self.prelabeler.take_errors()
+        if errors:
+            self.prelabel_timer.stop()
+            self.prelabeler.shutdown()
+            self.prelabeler = None
+            self.show_error(f"Pre-labeling stopped: {errors[0]}")
+            return
 
-        self.save_images(images_path)
-        self.model.save_calculations(calculations, labels_path)
+        path = self.model.get_current_image_path()
+        if not self.model.can_prelabel():
+            self.prelabel_timer.stop()
+            return
+        proposals = self.prelabeler.take(path)
+        if proposals is None:
+            if self.prelabeler.is_pending(path):
+                self.prelabel_timer.start()
+            else:
+                self.prelabel_timer.stop()
+            return
 
-    def create_exit_button(self):
+        self.prelabel_timer.stop()
+        if self.model.add_proposals(proposals, self.view.image.width(), self.view.image.height()):
+            metrics.increment("images_with_proposals")
+            self.view.update()
+            self.view.check_next_button_status()
+            self.view.check_discard_button_status()
+
+    def update_navigation(self):
         """
-        Creates the exit button if the current image is the last image.
+        Updates the navigation buttons for the current image, next and discard exit on the last image.
         :return: None
         """
-        if self.model.is_last_image():
-            self.view.discard_button.setText("Discard and Exit")
-            self.view.discard_button.clicked.disconnect()
-            self.view.discard_button.clicked.connect(lambda: self.exit_app(True))
-        if self.model.is_last_image():
-            self.view.next_button.setText("Exit")
-            self.view.next_button.clicked.disconnect()
-            self.view.next_button.clicked.connect(self.exit_app)
+        last = self.model.is_last_image()
+        self.view.next_button.setText("Exit" if last else "Next Image")
+        self.view.discard_button.setText("Discard and Exit" if last else "Discard Image")
+        self.view.previous_button.setEnabled(self.model.current_image_index > 0)
+        self.view.check_next_button_status()
+        self.view.check_discard_button_status()
 
-    def save_images(self, path):
+    def save_images(self, filepath):
         """
-        Saves the current image to the given path.
-        :param path: Path to save the images
+        Saves the current image to the given file.
+        :param filepath: File to save the image as
         :return: None
         """
-        filename = self.model.get_filename(".jpg")
-        filepath = os.path.join(path, filename)
+        if self.model.export_originals:
+            # YOLO labels are normalised and the displayed image stretches the whole source image,
+            # so the labels hold for the original as they are and it can be materialised without re-encoding
+            self.saver.link_file(self.model.get_original_image_path(), filepath)
+            return
+
+        image_path = self.model.get_current_image_path()
+        if not self.model.prescaled and self.image_cache:
+            image_path = self.image_cache.lookup(image_path, self.view.display_size, SCALING_MODE)
 
-        self.view.image.save(filepath)
+        if image_path:
+            # The pre-scaled or cached file already holds the displayed pixels, link it instead of re-encoding
+            self.saver.link_file(image_path, filepath)
+        else:
+            self.saver.write_image(self.view.image.toImage(), filepath)
+
+    def report_write_errors(self):
+        """
+        Shows the errors of the background writes that failed since the last check.
+        :return: None
+        """
+        errors = self.saver.take_errors()
+        if errors:
+            details = "\n".join(f"{path}: {error}" for path, error in errors)
+            self.show_error(f"Could not save {len(errors)} file(s):\n{details}")
 
     def exit_app(self, discard=False):
         """
-        Exits the application with splitting the dataset.
+        Exits the application after the queued writes are on disk.
+        :param discard: True if the current image is discarded instead of saved
         :return: None
         """
-        if not discard:
+        if discard:
+            self.discard()
+        else:
             self.save()
 
-        if self.model.is_create_dataset():
-            tmp_images = self.model.get_tmp_images()
-            tmp_labels = self.model.get_tmp_labels()
-
-            x, y = self.model.calculate_percentages()
-
-            train_images, test_images, train_labels, test_labels = self.model.split_dataset(tmp_images, tmp_labels, x)
-            if not train_images:
-                self.show_error("Your labels are not valid for stratified data splitting. "
-                                "You can manually split your data.")
-                self.model.move_to_dataset_folder_for_exception(tmp_images, tmp_labels)
-            val_images, test_images, val_labels, test_labels = self.model.split_dataset(test_images, test_labels, y)
-            if not val_images:
-                self.show_error(
-                    "Your labels are not valid for stratified data splitting. You can manually split your data.")
-                self.model.move_to_dataset_folder_for_exception(tmp_images, tmp_labels)
-            else:
-                self.model.move_to_dataset_folder(train_images, train_labels, val_images,
-                                                  val_labels, test_images, test_labels)
-        self.model.clear_temp()
+        self.saver.close()
+        self.journal.close()
+        self.report_write_errors()
+        if self.model.pack_shards and self.model.is_create_dataset():
+            self.pack_shards()
+        self.dump_metrics()
+
+        self.prelabel_timer.stop()
+        if self.prelabeler:
+            self.prelabeler.shutdown()
+        self.prefetcher.shutdown()
+        if self.image_cache:
+            self.image_cache.save()
         QApplication.quit()
 
+    def pack_shards(self):
+        """
+        Packs the finished dataset into shards while showing the progress.
+        :return: None
+        """
+        dialog = QProgressDialog("Packing dataset shards...", None, 0, 0, self.view)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.show()
+
+        def progress(done, total):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            QApplication.processEvents()
+
+        try:
+            self.model.export_shards(progress)
+        except (OSError, ValueError) as e:
+            self.show_error(f"Could not pack the dataset shards: {e}")
+        finally:
+            dialog.close()
+
+    def dump_metrics(self):
+        """
+        Writes the stage latencies and counters of the session to the metrics file.
+        :return: None
+        """
+        try:
+            metrics.dump(self.model.get_metrics_path())
+        except OSError as e:
+            self.show_error(f"Could not write the metrics: {e}")
+
     def start(self):
         """
         Starts the presenter.
         :return: None
         """
+        if self.model.is_create_dataset() and not self.model.existing_source:
+            self.model.create_dataset_paths()
+        if self.resume:
+            self.journal = SessionJournal.open(self.model.get_journal_path())
+        else:
+            self.journal = SessionJournal.create(self.model.get_journal_path(),
+                                                 self.model.get_session_header(self.view.display_size))
         self.load_initial_image()
         self.view.show()
 
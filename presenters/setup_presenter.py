@@ -1,6 +1,13 @@
-from PyQt5.QtWidgets import QMessageBox, QFileDialog
+import os
 
-from models.image_window_model import ImageWindowModel
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QMessageBox, QFileDialog, QProgressDialog, QApplication
+
+from models.batch_resize import resize_images
+from models.dataset_report import REPORT_FILENAME, build_report, summarize_report, write_report
+from models.image_window_model import SHARDS_FOLDER, ImageWindowModel
+from models.prelabel import DEFAULT_DEPTH, check_detector
+from models.session_journal import SessionJournal
 from presenters.image_window_presenter import ImageWindowPresenter
 from views.image_window_view import ImageWindowView
 
@@ -17,6 +24,9 @@ class SetupPresenter:
         self.view.select_folder_button.clicked.connect(self.select_images_folder)
         self.view.dataset_checkbox.toggled.connect(self.toggle_dataset_options)
         self.view.start_button.clicked.connect(self.start_processing)
+        self.view.resume_button.clicked.connect(self.resume_session)
+        self.view.open_existing_button.clicked.connect(self.open_existing)
+        self.view.report_button.clicked.connect(self.validate_dataset)
         self.view.import_json_btn.clicked.connect(self.import_json)
         self.view.dataset_folder_btn.clicked.connect(self.select_dataset_folder)
 
@@ -83,19 +93,209 @@ class SetupPresenter:
 
         width, height = self.get_resolution()
 
+        prelabel_detector = self.get_prelabel_detector()
+        if prelabel_detector is False:
+            return
+
         train_percentage, val_percentage, test_percentage = self.get_percentages()
 
         self.create_yaml_file()
 
+        duplicates = None
+        if self.view.skip_duplicates_checkbox.isChecked():
+            image_paths, duplicates = self.skip_near_duplicates(image_paths)
+            self.show_skipped_duplicates(duplicates)
+
+        prescaled = self.view.prescale_checkbox.isChecked()
+        original_paths = None
+        if prescaled:
+            original_paths, image_paths = self.prescale_images(image_paths, width, height)
+            if not image_paths:
+                return
+
         self.image_window_model = ImageWindowModel(
             image_paths, self.model.label_map, (train_percentage, val_percentage, test_percentage),
-            self.model.dataset_folder_path)
+            self.model.dataset_folder_path, prescaled, original_paths,
+            self.view.export_originals_checkbox.isChecked(), duplicates, self.view.shards_checkbox.isChecked(),
+            prelabel_detector=prelabel_detector, prelabel_depth=self.get_prelabel_depth())
         self.image_window_view = ImageWindowView((width, height), self.model.label_map)
         self.image_window_presenter = ImageWindowPresenter(self.image_window_view, self.image_window_model)
 
         self.image_window_presenter.start()
         self.view.close()
 
+    def resume_session(self):
+        """
+        Opens a dialog to select the dataset or output folder of an interrupted session and continues it
+        from its journal
+        :return: None
+        """
+        folder = QFileDialog.getExistingDirectory(self.view, "Select the dataset or output folder of the session")
+        if not folder:
+            return
+        journal_path = os.path.join(folder, SessionJournal.FILENAME)
+        if not os.path.exists(journal_path):
+            self.show_error("No session journal found in the selected folder")
+            return
+
+        records = SessionJournal.read(journal_path)
+        header = records[0]
+        existing = None
+        if "existing_source" in header:
+            try:
+                image_paths, existing, _ = self.model.index_existing_labels(**header["existing_source"])
+            except (OSError, ValueError) as e:
+                self.show_error(f"Could not read the existing labels: {e}")
+                return
+        elif "image_paths" in header:
+            image_paths = header["image_paths"]
+        else:
+            image_paths = self.model.stream_image_paths(header["image_source"])
+        self.image_window_model = ImageWindowModel(
+            image_paths, header["label_map"], header["percentages"], header["dataset_folder"],
+            header["prescaled"], header.get("original_paths"), header.get("export_originals", False),
+            header.get("duplicates"), header.get("pack_shards", False), header.get("existing_source"),
+            header.get("prelabel_detector"), header.get("prelabel_depth"))
+        if existing:
+            self.image_window_model.load_existing_labels(existing)
+        self.image_window_model.restore_from_journal(records)
+        if not self.image_window_model.has_image(self.image_window_model.current_image_index):
+            self.show_error("Every image of this session is already labeled")
+            return
+        self.show_skipped_duplicates(self.image_window_model.duplicates)
+
+        self.image_window_view = ImageWindowView(tuple(header["resolution"]), header["label_map"])
+        self.image_window_presenter = ImageWindowPresenter(self.image_window_view, self.image_window_model, True)
+
+        self.image_window_presenter.start()
+        self.view.close()
+
+    def open_existing(self):
+        """
+        Opens a dialog to select a dataset or labeled folder and labels it again in place, starting from
+        its existing labels. Only the label files of the images that are edited are rewritten
+        :return: None
+        """
+        if not self.model.label_map:
+            self.show_error("Add or import the labels of the dataset first")
+            return
+        folder = QFileDialog.getExistingDirectory(self.view, "Select the dataset or labeled folder to open")
+        if not folder:
+            return
+        resolution = self.get_resolution()
+        percentages = self.get_percentages()
+        if not resolution or not percentages:
+            return
+
+        self.model.set_discovery_options(False, self.view.extensions_input.text().split(","))
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            image_paths, existing, problems = self.model.index_existing_labels(folder)
+        except (OSError, ValueError) as e:
+            self.show_error(f"Could not read the existing labels: {e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        if not image_paths:
+            self.show_error("No images found in the selected folder")
+            return
+        if problems:
+            details = "\n".join(problems[:10])
+            self.show_error(f"{len(problems)} label file(s) have problems, their invalid boxes are not counted:\n"
+                            f"{details}")
+
+        # Datasets with splits keep the journal in the dataset folder, labeled folders next to their labels
+        dataset_folder = folder if existing[0]["split"] else ""
+        self.image_window_model = ImageWindowModel(
+            image_paths, self.model.label_map, percentages, dataset_folder,
+            existing_source={"folder": folder, "extensions": list(self.model.extensions)})
+        self.image_window_model.load_existing_labels(existing)
+        self.image_window_view = ImageWindowView(resolution, self.model.label_map)
+        self.image_window_presenter = ImageWindowPresenter(self.image_window_view, self.image_window_model)
+
+        self.image_window_presenter.start()
+        self.view.close()
+
+    def validate_dataset(self):
+        """
+        Opens a dialog to select a dataset or labelled folder, checks its labels against the label map and
+        writes the statistics and problems found to a report in that folder
+        :return: None
+        """
+        folder = QFileDialog.getExistingDirectory(self.view, "Select the dataset folder to validate")
+        if not folder:
+            return
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            report = build_report(folder, self.model.label_map)
+            report_path = os.path.join(folder, REPORT_FILENAME)
+            write_report(report, report_path)
+        except OSError as e:
+            self.show_error(f"Could not validate the dataset: {e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        QMessageBox.information(self.view, "Dataset Report",
+                                f"{summarize_report(report, self.model.label_map)}\n\nReport written to {report_path}")
+
+    def skip_near_duplicates(self, image_paths):
+        """
+        Hashes all images and drops the near-duplicates of earlier images from the labeling queue
+        :param image_paths: The paths of the images
+        :return: The kept paths and a dictionary of every skipped path to the kept path it duplicates
+        """
+        max_distance = int(self.view.duplicate_distance_input.text() or 5)
+        dialog = QProgressDialog("Finding near-duplicate images...", None, 0, 0, self.view)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.show()
+
+        def progress(done, total):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            QApplication.processEvents()
+
+        kept, duplicates = self.model.remove_near_duplicates(image_paths, max_distance, progress)
+        dialog.close()
+        return kept, duplicates
+
+    def show_skipped_duplicates(self, duplicates):
+        """
+        Shows how many near-duplicate images are left out of the labeling queue, if any
+        :param duplicates: Dictionary of every skipped path to the kept path it duplicates
+        :return: None
+        """
+        if duplicates:
+            QMessageBox.information(self.view, "Near-Duplicate Images",
+                                    f"{len(duplicates)} near-duplicate image(s) are skipped, "
+                                    f"only the first image of each group is labeled")
+
+    def prescale_images(self, image_paths, width, height):
+        """
+        Scales all images to the display resolution on every CPU core before labeling starts. Images that
+        could not be scaled are left out and reported once all images are done
+        :param image_paths: The paths of the images
+        :param width: The width of the scaled images
+        :param height: The height of the scaled images
+        :return: The paths of the images that were scaled and the paths of their scaled images, in the same order
+        """
+        dialog = QProgressDialog("Pre-scaling images...", None, 0, len(image_paths), self.view)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.show()
+
+        def progress(done, total):
+            dialog.setValue(done)
+            QApplication.processEvents()
+
+        scaled, failed = resize_images(image_paths, self.model.get_prescale_folder(width, height), (width, height),
+                                       progress=progress)
+        dialog.close()
+        if failed:
+            details = "\n".join(f"{path}: {error}" for path, error in list(failed.items())[:10])
+            self.show_error(f"Could not scale {len(failed)} image(s), they are skipped:\n{details}")
+        original_paths = [path for path in image_paths if path in scaled]
+        return original_paths, [scaled[path] for path in original_paths]
+
     def import_json(self):
         """
         Opens a dialog to select a JSON file containing labels
@@ -147,6 +347,8 @@ class SetupPresenter:
         Returns a list of paths of images in the images folder
         :return: A list of paths of images in the images folder
         """
+        self.model.set_discovery_options(self.view.recursive_checkbox.isChecked(),
+                                         self.view.extensions_input.text().split(","))
         image_paths = self.model.get_image_paths()
 
         # Check if there are images in the folder
@@ -169,6 +371,28 @@ class SetupPresenter:
             return
         return width, height
 
+    def get_prelabel_detector(self):
+        """
+        Returns the detector spec used to pre-label images, after checking that it can be loaded
+        :return: The detector spec, None if pre-labeling is off, False if the spec is invalid
+        """
+        if not self.view.prelabel_checkbox.isChecked():
+            return None
+        spec = self.view.prelabel_detector_input.text().strip()
+        try:
+            check_detector(spec)
+        except (ImportError, ValueError) as e:
+            self.show_error(f"Invalid pre-labeling detector: {e}")
+            return False
+        return spec
+
+    def get_prelabel_depth(self):
+        """
+        Returns how many upcoming images are queued for pre-labeling
+        :return: The queue depth
+        """
+        return int(self.view.prelabel_depth_input.text()) if self.view.prelabel_depth_input.text() else DEFAULT_DEPTH
+
     def get_percentages(self):
         """
         Returns the percentages of training, validation, and test images
@@ -213,3 +437,5 @@ class SetupPresenter:
                 return
 
         self.model.create_yaml_file()
+        if self.view.shards_checkbox.isChecked():
+            self.model.create_yaml_file(SHARDS_FOLDER)
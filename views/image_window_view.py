@@ -1,35 +1,72 @@
-from PyQt5.QtWidgets import QWidget, QPushButton, QComboBox
-from PyQt5.QtGui import QPixmap, QPainter, QPen
-from PyQt5.QtCore import Qt, QRect, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QPushButton, QComboBox, QLineEdit
+from PyQt5.QtGui import QPixmap, QPainter, QPen, QFont, QFontMetrics
+from PyQt5.QtCore import Qt, QRect, QPoint, pyqtSignal
+
+from models.box_store import BoxStore
+from models.image_loader import load_scaled_image
+from models.metrics import metrics
 
 
 class ImageWindowView(QWidget):
-    rectangle_added = pyqtSignal(object, int)
+    rectangle_added = pyqtSignal(object, object)
     rectangle_removed = pyqtSignal()
+    box_changed = pyqtSignal(int, object)
+    box_deleted = pyqtSignal(int)
+
+    HANDLE_SIZE = 8
 
     def __init__(self, resolution=(800, 600), label_map=None):
         super().__init__()
 
         # Define the maximum display size
         self.display_size = resolution
+        self.image_cache = None  # Optional ScaledImageCache set by the presenter
         self.image = QPixmap(self.display_size[0], self.display_size[1])  # Placeholder for image
-        self.rectangles = []
+        self.boxes = BoxStore(spatial_index=True)  # Replaced by the model's box store in the presenter
         self.label_map = label_map if label_map else {}
+        self.label_names = {int(key): value for key, value in self.label_map.items()}
 
         # Drawing attributes
         self.startPoint = None
         self.endPoint = None
         self.isDrawing = False
 
+        # Rendering attributes, the image with the committed boxes is cached as one layer
+        self.box_pen = QPen(Qt.red, 3, Qt.SolidLine)
+        self.label_font = QFont(self.font())
+        self.box_layer = None
+        self.box_layer_key = None
+        self.selection_pen = QPen(Qt.yellow, 2, Qt.DashLine)
+
+        # Editing attributes, a selected box can be moved or resized by dragging it or its corners
+        self.selected_index = None
+        self.edit_mode = None
+        self.edit_origin = None
+        self.edit_anchor = None
+        self.edit_rect = None
+        self.setFocusPolicy(Qt.ClickFocus)
+
         # Add Next button
         self.next_button = QPushButton("Next Image", self)
 
         # Add Discard button
         self.discard_button = QPushButton("Discard Image", self)
 
+        # Add Previous button
+        self.previous_button = QPushButton("Previous", self)
+        self.previous_button.setEnabled(False)
+
+        # Add jump input, takes an image number or a file name
+        self.jump_input = QLineEdit(self)
+        self.jump_input.setPlaceholderText("Go to # or name")
+
         # Add Undo button
         self.undo_button = QPushButton("Undo", self)
 
+        # Add Delete button
+        self.delete_button = QPushButton("Delete Box", self)
+        self.delete_button.setEnabled(False)
+
         # Add ComboBox
         self.comboBox = QComboBox(self)
         for key, value in self.label_map.items():
@@ -65,9 +102,18 @@ class ImageWindowView(QWidget):
         self.discard_button.resize(100, 30)
         self.discard_button.move(self.image.width() - 220, self.image.height() + 5)
 
+        self.previous_button.resize(100, 30)
+        self.previous_button.move(self.image.width() - 330, self.image.height() + 5)
+
+        self.jump_input.resize(110, 30)
+        self.jump_input.move(345, self.image.height() + 5)
+
         self.undo_button.resize(100, 30)
         self.undo_button.move(125, self.image.height() + 5)
 
+        self.delete_button.resize(100, 30)
+        self.delete_button.move(235, self.image.height() + 5)
+
         self.comboBox.resize(100, 30)
         self.comboBox.move(15, self.image.height() + 5)
 
@@ -77,41 +123,44 @@ class ImageWindowView(QWidget):
         :param path: Path to the image
         :return: Scaled image
         """
-        pixmap = QPixmap(path)
-        scaled_pixmap = pixmap.scaled(self.display_size[0], self.display_size[1])
-        return scaled_pixmap
+        return QPixmap.fromImage(load_scaled_image(path, self.display_size, self.image_cache))
 
-    def set_image(self, path):
+    def set_image(self, path, image=None):
         """
         Sets the image to be displayed.
         :param path: Path to the image
+        :param image: Already decoded and scaled QImage, loaded from path if not given
         :return: None
         """
-        self.image = self.load_and_scale_image(path)
+        if image is not None and not image.isNull():
+            self.image = QPixmap.fromImage(image)
+        else:
+            self.image = self.load_and_scale_image(path)
+        self.select_box(None)
         self.update_ui()
         self.update()
 
     def add_rectangle(self, rectangle, label):
         """
-        Adds a rectangle to the list of rectangles.
+        Emits the rectangle so it is added to the box store.
         :param rectangle: Rectangle Object
         :param label: Label string
         :return: None
         """
         self.rectangle_added.emit(rectangle, self.comboBox.itemData(self.comboBox.currentIndex()))
-        self.rectangles.append((rectangle, label))
         self.check_next_button_status()
         self.check_discard_button_status()
         self.update()
 
     def remove_last_rectangle(self):
         """
-        Removes the last rectangle from the list of rectangles.
+        Emits the removal of the last rectangle from the box store.
         :return: None
         """
-        self.rectangle_removed.emit()
-        if self.rectangles:
-            self.rectangles.pop()
+        if len(self.boxes):
+            if self.selected_index == len(self.boxes) - 1:
+                self.select_box(None)
+            self.rectangle_removed.emit()
 
             # Reset the temporary drawing points
             self.startPoint = None
@@ -120,48 +169,213 @@ class ImageWindowView(QWidget):
             self.check_discard_button_status()
             self.update()
 
+    def select_box(self, index):
+        """
+        Selects the box at the given position of the box store.
+        :param index: Position of the box, None to clear the selection
+        :return: None
+        """
+        self.selected_index = index
+        self.delete_button.setEnabled(index is not None)
+        self.update()
+
+    def delete_selected_box(self):
+        """
+        Emits the deletion of the selected box from the box store.
+        :return: None
+        """
+        if self.selected_index is None:
+            return
+        index = self.selected_index
+        self.select_box(None)
+        self.box_deleted.emit(index)
+        self.check_next_button_status()
+        self.check_discard_button_status()
+        self.update()
+
+    def get_box_rect(self, index):
+        """
+        Returns a box of the box store as a rectangle.
+        :param index: Position of the box
+        :return: QRect
+        """
+        x1, y1, x2, y2, _ = self.boxes.get_box(index)
+        return QRect(QPoint(int(x1), int(y1)), QPoint(int(x2), int(y2)))
+
+    def get_label_name(self, label):
+        """
+        Returns the display name of a label.
+        :param label: The label number
+        :return: Label string
+        """
+        return self.label_names.get(label, str(label))
+
+    def get_box_layer(self):
+        """
+        Returns the image with the committed rectangles drawn on it, redrawn only when the image or boxes change.
+        The box being edited is left out, it is drawn on top while it moves.
+        :return: QPixmap layer
+        """
+        hidden_index = self.selected_index if self.edit_mode else None
+        key = (self.image.cacheKey(), id(self.boxes), self.boxes.version, hidden_index)
+        if self.box_layer is None or key != self.box_layer_key:
+            layer = QPixmap(self.image)
+            painter = QPainter(layer)
+            painter.setPen(self.box_pen)
+            painter.setFont(self.label_font)
+            for index, (x1, y1, x2, y2, label) in enumerate(self.boxes.rows()):
+                if index == hidden_index:
+                    continue
+                rectangle = QRect(QPoint(int(x1), int(y1)), QPoint(int(x2), int(y2)))
+                painter.drawRect(rectangle)
+                painter.drawText(rectangle.center(), self.get_label_name(label))
+            painter.end()
+            self.box_layer, self.box_layer_key = layer, key
+        return self.box_layer
+
+    def get_rubber_band_rect(self):
+        """
+        Returns the area covered by the rectangle being drawn, including the pen width.
+        :return: QRect, empty if nothing is being drawn
+        """
+        if not (self.startPoint and self.endPoint):
+            return QRect()
+        margin = self.box_pen.width() // 2 + 2
+        return QRect(self.startPoint, self.endPoint).normalized().adjusted(-margin, -margin, margin, margin)
+
+    def get_edit_dirty_rect(self):
+        """
+        Returns the area covered by the box being edited, including its handles and label.
+        :return: QRect, empty if no box is being edited
+        """
+        if not self.edit_mode:
+            return QRect()
+        margin = self.HANDLE_SIZE // 2 + self.box_pen.width()
+        label = self.get_label_name(self.boxes.get_box(self.selected_index)[4])
+        label_rect = QFontMetrics(self.label_font).boundingRect(label).translated(self.edit_rect.center())
+        return self.edit_rect.adjusted(-margin, -margin, margin, margin).united(label_rect.adjusted(-2, -2, 2, 2))
+
+    def get_resize_anchor(self, point):
+        """
+        Returns the opposite corner if the point is on a corner handle of the selected box.
+        :param point: QPoint
+        :return: QPoint of the opposite corner, None if no handle is hit
+        """
+        if self.selected_index is None:
+            return None
+        rectangle = self.get_box_rect(self.selected_index)
+        corners = [(rectangle.topLeft(), rectangle.bottomRight()), (rectangle.topRight(), rectangle.bottomLeft()),
+                   (rectangle.bottomLeft(), rectangle.topRight()), (rectangle.bottomRight(), rectangle.topLeft())]
+        for corner, opposite in corners:
+            if (point - corner).manhattanLength() <= self.HANDLE_SIZE:
+                return opposite
+        return None
+
+    def draw_handles(self, painter, rectangle):
+        """
+        Draws the corner handles of a box.
+        :param painter: QPainter
+        :param rectangle: QRect of the box
+        :return: None
+        """
+        half = self.HANDLE_SIZE // 2
+        for corner in (rectangle.topLeft(), rectangle.topRight(), rectangle.bottomLeft(), rectangle.bottomRight()):
+            painter.fillRect(QRect(corner.x() - half, corner.y() - half, self.HANDLE_SIZE, self.HANDLE_SIZE),
+                             Qt.yellow)
+
     def paintEvent(self, event):
         """
-        Paints the image and rectangles.
+        Paints the dirty region of the cached image layer, the selected or edited box and the rectangle being drawn.
         :param event: Event object
         :return: None
         """
-        painter = QPainter(self)
-        painter.drawPixmap(0, 0, self.image)
+        with metrics.timer("paint"):
+            painter = QPainter(self)
+            dirty = event.rect()
+            painter.drawPixmap(dirty, self.get_box_layer(), dirty)
 
-        for rectangle, label in self.rectangles:
-            pen = QPen(Qt.red, 3, Qt.SolidLine)
-            painter.setPen(pen)
-            painter.drawRect(rectangle)
-            painter.drawText(rectangle.center(), label)
+            if self.edit_mode:
+                painter.setPen(self.box_pen)
+                painter.setFont(self.label_font)
+                painter.drawRect(self.edit_rect)
+                painter.drawText(self.edit_rect.center(),
+                                 self.get_label_name(self.boxes.get_box(self.selected_index)[4]))
+                self.draw_handles(painter, self.edit_rect)
+            elif self.selected_index is not None and self.selected_index < len(self.boxes):
+                rectangle = self.get_box_rect(self.selected_index)
+                painter.setPen(self.selection_pen)
+                painter.drawRect(rectangle)
+                self.draw_handles(painter, rectangle)
 
-        if self.startPoint and self.endPoint:
-            pen = QPen(Qt.red, 3, Qt.SolidLine)
-            painter.setPen(pen)
-            painter.drawRect(QRect(self.startPoint, self.endPoint))
-        painter.end()
+            if self.startPoint and self.endPoint:
+                painter.setPen(self.box_pen)
+                painter.drawRect(QRect(self.startPoint, self.endPoint))
+            painter.end()
 
     def mousePressEvent(self, event):
         """
-        Handles the mousePressEvent.
+        Handles the mousePressEvent. Pressing a corner handle of the selected box resizes it, pressing a box
+        selects and moves it, anywhere else a new rectangle is drawn. Hold Shift to draw over existing boxes.
         :param event: Event object
         :return: None
         """
-        if event.button() == Qt.LeftButton and self.is_within_image_bounds(event.pos()):
-            self.startPoint = event.pos()
-            self.endPoint = event.pos()
-            self.isDrawing = True
-            self.update()
+        if event.button() != Qt.LeftButton or not self.is_within_image_bounds(event.pos()):
+            return
+
+        anchor = self.get_resize_anchor(event.pos())
+        if anchor is not None:
+            self.start_edit("resize", event.pos())
+            self.edit_anchor = anchor
+            return
+
+        if not event.modifiers() & Qt.ShiftModifier:
+            index = self.boxes.hit_test(event.x(), event.y(), self.box_pen.width())
+            if index is not None:
+                self.select_box(index)
+                self.start_edit("move", event.pos())
+                return
+
+        self.select_box(None)
+        self.startPoint = event.pos()
+        self.endPoint = event.pos()
+        self.isDrawing = True
+        self.update(self.get_rubber_band_rect())
+
+    def start_edit(self, mode, point):
+        """
+        Starts moving or resizing the selected box.
+        :param mode: "move" or "resize"
+        :param point: QPoint where the mouse was pressed
+        :return: None
+        """
+        self.edit_mode = mode
+        self.edit_origin = point
+        self.edit_rect = self.get_box_rect(self.selected_index)
+        self.update()
 
     def mouseMoveEvent(self, event):
         """
-        Handles the mouseMoveEvent.
+        Handles the mouseMoveEvent. Only the area of the old and new rubber band or edited box is repainted.
         :param event: Event object
         :return: None
         """
-        if self.isDrawing and self.is_within_image_bounds(event.pos()):
+        if self.edit_mode:
+            previous = self.get_edit_dirty_rect()
+            point = QPoint(min(max(event.x(), 0), self.image.width() - 1),
+                           min(max(event.y(), 0), self.image.height() - 1))
+            if self.edit_mode == "move":
+                rectangle = self.get_box_rect(self.selected_index)
+                offset = point - self.edit_origin
+                dx = min(max(offset.x(), -rectangle.left()), self.image.width() - 1 - rectangle.right())
+                dy = min(max(offset.y(), -rectangle.top()), self.image.height() - 1 - rectangle.bottom())
+                self.edit_rect = rectangle.translated(dx, dy)
+            else:
+                self.edit_rect = QRect(self.edit_anchor, point).normalized()
+            self.update(previous.united(self.get_edit_dirty_rect()))
+        elif self.isDrawing and self.is_within_image_bounds(event.pos()):
+            previous = self.get_rubber_band_rect()
             self.endPoint = event.pos()
-            self.update()
+            self.update(previous.united(self.get_rubber_band_rect()))
 
     def mouseReleaseEvent(self, event):
         """
@@ -169,21 +383,39 @@ class ImageWindowView(QWidget):
         :param event: Event object
         :return: None
         """
-        if self.isDrawing:
+        if self.edit_mode:
+            self.edit_mode = None
+            if self.edit_rect != self.get_box_rect(self.selected_index):
+                self.box_changed.emit(self.selected_index, self.edit_rect)
+            self.update()
+        elif self.isDrawing:
             self.endPoint = event.pos()
             self.isDrawing = False
+            previous = self.get_rubber_band_rect()
             if self.startPoint != self.endPoint:
                 current_label = self.comboBox.currentText()
                 self.add_rectangle(QRect(self.startPoint, self.endPoint), current_label)
             self.startPoint = None
             self.endPoint = None
+            self.update(previous)
+
+    def keyPressEvent(self, event):
+        """
+        Handles the keyPressEvent. Delete or Backspace removes the selected box.
+        :param event: Event object
+        :return: None
+        """
+        if event.key() in (Qt.Key_Delete, Qt.Key_Backspace) and self.selected_index is not None:
+            self.delete_selected_box()
+        else:
+            super().keyPressEvent(event)
 
     def check_next_button_status(self):
         """
         Checks the status of the next button.
         :return: None
         """
-        if self.rectangles:
+        if len(self.boxes):
             self.next_button.setEnabled(True)
         else:
             self.next_button.setEnabled(False)
@@ -193,7 +425,7 @@ class ImageWindowView(QWidget):
         Checks the status of the next button.
         :return: None
         """
-        if self.rectangles:
+        if len(self.boxes):
             self.discard_button.setEnabled(False)
         else:
             self.discard_button.setEnabled(True)
@@ -40,6 +40,41 @@ class SetupView(QWidget):
         folder_layout.addWidget(self.import_json_btn)
         layout.addLayout(folder_layout)
 
+        # Image discovery section
+        self.recursive_checkbox = QCheckBox("Include Subfolders", self)
+        self.extensions_input = QLineEdit(self)
+        self.extensions_input.setPlaceholderText("Extensions - Default: jpg, jpeg, png, webp, bmp, tif, tiff")
+
+        discovery_layout = QHBoxLayout()
+        discovery_layout.addWidget(self.recursive_checkbox)
+        discovery_layout.addWidget(self.extensions_input)
+        layout.addLayout(discovery_layout)
+
+        # Near-duplicate section
+        self.skip_duplicates_checkbox = QCheckBox("Skip Near-Duplicate Images", self)
+        self.duplicate_distance_input = QLineEdit(self)
+        self.duplicate_distance_input.setValidator(QIntValidator(0, 32))
+        self.duplicate_distance_input.setPlaceholderText("Max Hash Distance - Default: 5")
+
+        duplicates_layout = QHBoxLayout()
+        duplicates_layout.addWidget(self.skip_duplicates_checkbox)
+        duplicates_layout.addWidget(self.duplicate_distance_input)
+        layout.addLayout(duplicates_layout)
+
+        # Pre-labeling section
+        self.prelabel_checkbox = QCheckBox("Pre-label with Detector", self)
+        self.prelabel_detector_input = QLineEdit(self)
+        self.prelabel_detector_input.setPlaceholderText("Detector - stub, onnx:model.onnx or module:function")
+        self.prelabel_depth_input = QLineEdit(self)
+        self.prelabel_depth_input.setValidator(QIntValidator(1, 1024))
+        self.prelabel_depth_input.setPlaceholderText("Queue Depth - Default: 16")
+
+        prelabel_layout = QHBoxLayout()
+        prelabel_layout.addWidget(self.prelabel_checkbox)
+        prelabel_layout.addWidget(self.prelabel_detector_input)
+        prelabel_layout.addWidget(self.prelabel_depth_input)
+        layout.addLayout(prelabel_layout)
+
         # Resolution section
         self.width_input = QLineEdit(self)
         self.width_input.setValidator(QIntValidator())  # Only allow integers
@@ -53,6 +88,8 @@ class SetupView(QWidget):
         resolution_layout = QHBoxLayout()
         resolution_layout.addWidget(self.width_input)
         resolution_layout.addWidget(self.height_input)
+        self.prescale_checkbox = QCheckBox("Pre-scale Images", self)
+        resolution_layout.addWidget(self.prescale_checkbox)
         resolution_group.setLayout(resolution_layout)
         layout.addWidget(resolution_group)
 
@@ -60,6 +97,10 @@ class SetupView(QWidget):
         self.dataset_checkbox = QCheckBox("Create Dataset", self)
         layout.addWidget(self.dataset_checkbox)
 
+        # Export Checkbox
+        self.export_originals_checkbox = QCheckBox("Export Original Images (No Re-encoding)", self)
+        layout.addWidget(self.export_originals_checkbox)
+
         # Dataset Options in a GroupBox
         self.dataset_options_group = QGroupBox("Dataset Options", self)
         self.dataset_folder_btn = QPushButton("Select Dataset Folder", self)
@@ -76,6 +117,7 @@ class SetupView(QWidget):
         self.test_percentage_input.setPlaceholderText("15")  # Default suggestion
 
         self.yaml_checkbox = QCheckBox("Create Yaml File", self)
+        self.shards_checkbox = QCheckBox("Pack Dataset into Shards on Exit", self)
 
         dataset_options_layout = QVBoxLayout(self.dataset_options_group)
         dataset_options_layout.addWidget(self.dataset_folder_btn)
@@ -83,13 +125,23 @@ class SetupView(QWidget):
         dataset_options_layout.addWidget(self.val_percentage_input)
         dataset_options_layout.addWidget(self.test_percentage_input)
         dataset_options_layout.addWidget(self.yaml_checkbox)
+        dataset_options_layout.addWidget(self.shards_checkbox)
 
         layout.addWidget(self.dataset_options_group)
 
         # Start button section
         self.start_button = QPushButton("Start", self)
         self.start_button.setEnabled(False)  # Initially disabled
-        layout.addWidget(self.start_button)
+        self.resume_button = QPushButton("Resume Session", self)
+        self.open_existing_button = QPushButton("Open Existing", self)
+        self.report_button = QPushButton("Validate Dataset", self)
+
+        start_layout = QHBoxLayout()
+        start_layout.addWidget(self.start_button)
+        start_layout.addWidget(self.resume_button)
+        start_layout.addWidget(self.open_existing_button)
+        start_layout.addWidget(self.report_button)
+        layout.addLayout(start_layout)
 
         self.dataset_options_group.hide()  # Hide it initially
         self.setLayout(layout)